@@ -1,193 +1,385 @@
 import os
 import json
-import base64
 import threading
 import time
-import re
-import requests
 
+import click
 from flask import (
-    Flask, session, redirect, url_for,
+    Blueprint, Flask, session, redirect, url_for,
     request, render_template, current_app, Response
 )
-from flask_migrate import Migrate
-from authlib.integrations.flask_client import OAuth
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from email.mime.text import MIMEText
+from flask.cli import AppGroup
 from dotenv import load_dotenv
-import openai
 
 from datetime import datetime, timedelta
-from dateutil.parser import parse as date_parse
-import dateparser
 
-from models import db, Email, CalendarEvent, Embedding, Task
-from ingestion import ingest_gmail, ingest_calendar
+from models import db, IndexVersion, Task
+from chat import (
+    CHAT_MODEL, FUNCTIONS, availability_email, await_contact, await_slot_reply,
+    build_messages, completion_tokens, event_body, find_contact, free_slots,
+    freebusy_query, function_call_for, pending_contact, raw_message, requested_attendees
+)
+from documents import MAX_EMBED_CHARS
+from ingestion import ingest_gmail, fetch_concurrently
+from backfill import backfill_gmail
+from calendar_sync import sync_calendar
+from google_clients import credentials_from_token, google_service
 from vectorstore import get_top_k_docs
+from ratelimit import chat_call, google_execute
+from database import pool_stats
+from slot_parser import clean_reply, match_reply, stats as slot_parser_stats
 
-load_dotenv(os.getenv("ENV_PATH", ".env"))
+bp = Blueprint("main", __name__)
 
-openai.api_key = os.getenv("OPENAI_API_KEY")
+def init_schema(app):
+    """Create missing tables and monthly partitions; a deploy/startup step, kept off the request path."""
+    with app.app_context():
+        db.create_all()
+        try:
+            from partitions import ensure_partitions
+            ensure_partitions()
+        except Exception as e:
+            # New rows still land in the default partition; `flask partitions ensure` retries
+            app.logger.error(f"Couldn't create monthly partitions: {e}")
+        try:
+            from vectorstore import sync_ann_index
+            sync_ann_index()
+        except Exception as e:
+            # Search still works, by exact scan; `flask index ann` retries
+            app.logger.error(f"Couldn't sync the ANN index: {e}")
+
+def create_app():
+    """Application factory.
+
+    Only configuration happens here: the OAuth client, Google clients and vector
+    store are set up on first use, and the schema by `init_schema` at deploy or
+    startup, so importing the app (CLI tools, tests, forked workers) stays cheap.
+    """
+    load_dotenv(os.getenv("ENV_PATH", ".env"))
+
+    app = Flask(__name__, template_folder="templates")
+    app.config.update(
+        SECRET_KEY=os.getenv("SECRET_KEY", "dev-secret"),
+        SQLALCHEMY_DATABASE_URI=os.getenv("DATABASE_URL"),
+        SQLALCHEMY_TRACK_MODIFICATIONS=False,
+        POLL_INTERVAL_SECONDS=int(os.getenv("POLL_INTERVAL_SECONDS", 60)),
+        OPENAI_API_KEY=os.getenv("OPENAI_API_KEY"),
+    )
 
-app = Flask(__name__, template_folder="templates")
-app.config.update(
-    SECRET_KEY=os.getenv("SECRET_KEY", "dev-secret"),
-    SQLALCHEMY_DATABASE_URI=os.getenv("DATABASE_URL"),
-    SQLALCHEMY_TRACK_MODIFICATIONS=False,
-    POLL_INTERVAL_SECONDS=int(os.getenv("POLL_INTERVAL_SECONDS", 60)),
-)
+    db.init_app(app)
+    app.register_blueprint(bp)
+
+    @app.cli.command("init-db")
+    def init_db():
+        """Create any missing tables and the upcoming monthly partitions."""
+        init_schema(app)
+
+    index_cli = AppGroup("index", help="Manage versioned vector indexes.")
+
+    @index_cli.command("rebuild")
+    @click.option("--model", default="text-embedding-ada-002", show_default=True)
+    @click.option("--dimensions", type=int, default=None, help="Shorten vectors (text-embedding-3 models).")
+    @click.option("--chunk-chars", type=int, default=MAX_EMBED_CHARS, show_default=True)
+    @click.option("--no-activate", is_flag=True, help="Validate but leave the current version serving.")
+    def index_rebuild(model, dimensions, chunk_chars, no_activate):
+        """Build a new index version in the background and switch to it once it validates."""
+        from reindex import reindex
+        ok = reindex(model, dimensions, chunk_chars, activate_when_valid=not no_activate)
+        raise SystemExit(0 if ok else 1)
+
+    @index_cli.command("status")
+    def index_status():
+        """List index versions."""
+        for v in IndexVersion.query.order_by(IndexVersion.id):
+            click.echo(
+                f"{v.collection:<24} {v.status:<9} {v.model} dims={v.dimensions or 'native'} "
+                f"chunk={v.chunk_chars} processed={v.processed or 0} report={v.report or {}}"
+            )
 
-db.init_app(app)
-migrate = Migrate(app, db)
-
-oauth = OAuth(app)
-oauth.register(
-    name="google",
-    server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
-    client_id=os.getenv("GOOGLE_CLIENT_ID"),
-    client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
-    client_kwargs={
-        "access_type": "offline",
-        "prompt": "consent",
-        "scope": (
-            "openid email profile "
-            "https://www.googleapis.com/auth/gmail.readonly "
-            "https://www.googleapis.com/auth/gmail.send "
-            "https://www.googleapis.com/auth/calendar.events "
-            "https://www.googleapis.com/auth/calendar.readonly "
-        )
-    }
-)
+    @index_cli.command("activate")
+    @click.argument("collection")
+    def index_activate(collection):
+        """Switch search to COLLECTION (also used to roll back)."""
+        from reindex import activate
+        activate(collection)
+        click.echo(f"{collection} is now active.")
+
+    @index_cli.command("drop")
+    @click.argument("collection")
+    def index_drop(collection):
+        """Delete a retired or failed version."""
+        from reindex import drop
+        drop(collection)
+        click.echo(f"Dropped {collection}.")
+
+    @index_cli.command("ann")
+    def index_ann():
+        """Build the ANN index VECTOR_SEARCH_MODE needs and drop the unused ones."""
+        from vectorstore import SEARCH_MODE, sync_ann_index
+        created, dropped = sync_ann_index()
+        click.echo(f"{SEARCH_MODE}: created {', '.join(created) or 'nothing'}; "
+                   f"dropped {', '.join(dropped) or 'nothing'}.")
+
+    app.cli.add_command(index_cli)
+
+    partitions_cli = AppGroup("partitions", help="Manage the monthly partitions of emails and embeddings.")
+
+    @partitions_cli.command("ensure")
+    @click.option("--months-ahead", type=int, default=3, show_default=True)
+    @click.option("--since", type=click.DateTime(["%Y-%m"]), default=None, help="First month to create.")
+    def partitions_ensure(months_ahead, since):
+        """Create missing monthly partitions; schedule it monthly."""
+        from partitions import ensure_partitions
+        click.echo(f"Created: {', '.join(ensure_partitions(months_ahead, since)) or 'nothing'}")
+
+    @partitions_cli.command("status")
+    def partitions_status():
+        """List partitions with their row estimates, sizes and tablespaces."""
+        from partitions import partitions
+        for table, name, month, rows, size, tablespace in partitions():
+            click.echo(
+                f"{name:<28} {month.strftime('%Y-%m') if month else 'default':<8} "
+                f"rows~{rows:<9} {size / 2**20:8.1f} MB  {tablespace}"
+            )
 
-with app.app_context():
-    db.create_all()
+    @partitions_cli.command("move")
+    @click.option("--before", type=click.DateTime(["%Y-%m"]), required=True)
+    @click.option("--tablespace", required=True)
+    def partitions_move(before, tablespace):
+        """Move the partitions older than BEFORE to TABLESPACE."""
+        from partitions import move_partitions
+        click.echo(f"Moved: {', '.join(move_partitions(before, tablespace)) or 'nothing'}")
+
+    @partitions_cli.command("detach")
+    @click.option("--before", type=click.DateTime(["%Y-%m"]), required=True)
+    def partitions_detach(before):
+        """Detach the partitions older than BEFORE, keeping them as plain tables."""
+        from partitions import detach_partitions
+        click.echo(f"Detached: {', '.join(detach_partitions(before)) or 'nothing'}")
+
+    @partitions_cli.command("drop")
+    @click.option("--before", type=click.DateTime(["%Y-%m"]), required=True)
+    @click.confirmation_option(prompt="Delete these months of mail and vectors for good?")
+    def partitions_drop(before):
+        """Drop the partitions older than BEFORE and their vector-store documents."""
+        from partitions import drop_partitions
+        click.echo(f"Dropped: {', '.join(drop_partitions(before)) or 'nothing'}")
+
+    app.cli.add_command(partitions_cli)
+
+    # Flask-Migrate pulls in alembic; only the `flask db` commands need it
+    if os.getenv("FLASK_MIGRATE", "1") == "1":
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    return app
+
+def _oauth():
+    """Register the Google OAuth client the first time a login needs it."""
+    app = current_app._get_current_object()
+    if "google_oauth" not in app.extensions:
+        from authlib.integrations.flask_client import OAuth
+        oauth = OAuth(app)
+        oauth.register(
+            name="google",
+            server_metadata_url="https://accounts.google.com/.well-known/openid-configuration",
+            client_id=os.getenv("GOOGLE_CLIENT_ID"),
+            client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
+            client_kwargs={
+                "access_type": "offline",
+                "prompt": "consent",
+                "scope": (
+                    "openid email profile "
+                    "https://www.googleapis.com/auth/gmail.readonly "
+                    "https://www.googleapis.com/auth/gmail.send "
+                    "https://www.googleapis.com/auth/calendar.events "
+                    "https://www.googleapis.com/auth/calendar.readonly "
+                )
+            }
+        )
+        app.extensions["google_oauth"] = oauth
+    return app.extensions["google_oauth"]
 
-RULES_TEXT = (
-    "You are an AI assistant with access to the user's Gmail and Calendar. "
-    "Answer general queries in natural language using the provided context. "
-    "When asked to send an email or create a calendar event, respond only with the JSON for the corresponding function call. "
-    "Do NOT ask any follow-up questions. "
-    "If scheduling and no date/time is provided, include only 'summary'; server will handle availability and follow-up."
-)
+def _openai():
+    import openai
+    openai.api_key = current_app.config["OPENAI_API_KEY"]
+    return openai
 
 def _get_creds_from_config():
-    tok = app.config.get("GOOGLE_TOKEN")
+    tok = current_app.config.get("GOOGLE_TOKEN")
     if not tok:
         raise RuntimeError("Google token not found in app.config")
-    return Credentials(
-        token=tok["access_token"],
-        refresh_token=tok.get("refresh_token"),
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=os.getenv("GOOGLE_CLIENT_ID"),
-        client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
-    )
-
-def _poll_for_slot_tasks():
-    with app.app_context():
-        interval = app.config["POLL_INTERVAL_SECONDS"]
-        while True:
-            token = app.config.get("GOOGLE_TOKEN")
-            if token:
-                creds = _get_creds_from_config()
-                svc = build("gmail", "v1", credentials=creds)
-                now = datetime.now()
-
-                tasks = Task.query.filter_by(status="waiting_for_slot").all()
-                for task in tasks:
-                    params   = task.parameters
-                    thread_id = params.get("thread_id")
-                    if not thread_id:
-                        continue
-
-                    thread = svc.users().threads().get(
-                        userId="me", id=thread_id, format="full"
-                    ).execute()
-                    messages = thread.get("messages", [])
-                    if len(messages) <= 1:
-                        current_app.logger.info(f"[Polling] No reply yet for thread {thread_id}")
-                        continue
-
-                    raw_snip = messages[-1].get("snippet", "")
-                    cleaned  = raw_snip.split("On ")[0].split("\n")[0].strip()
-                    current_app.logger.info(f"[Polling] Cleaned reply for {thread_id}: {cleaned}")
-
-                    slot_dt = dateparser.parse(cleaned, settings={"PREFER_DATES_FROM":"future"})
-                    if not slot_dt:
-                        try:
-                            slot_dt = date_parse(cleaned, default=now, fuzzy=True)
-                        except Exception as e:
-                            current_app.logger.warning(f"[Polling] Couldn’t parse slot: {e}")
-                            continue
-
-                    if slot_dt < now:
-                        slot_dt = slot_dt.replace(year=now.year + 1)
-                    start_iso = slot_dt.isoformat()
-                    end_iso   = (slot_dt + timedelta(hours=1)).isoformat()
-
-                    orig = params.get("original_args", {})
-                    summary   = orig.get("summary")
-                    attendees = orig.get("attendees", [])
-                    if not summary:
-                        current_app.logger.error(
-                            f"[Polling] Missing summary in task.parameters: {params}"
-                        )
-                        continue
-
-                    current_app.logger.info(
-                        f"[Polling] Scheduling '{summary}' at {start_iso}"
-                    )
-                    ev = _create_event_internal({
-                        "summary":   summary,
-                        "attendees": attendees,
-                        "start":     start_iso,
-                        "end":       end_iso,
-                        "creator_email": params.get("creator_email")
-                    })
-                    current_app.logger.info(
-                        f"[Polling] Event created: id={ev.get('id')}"
-                    )
+    # Reuse the Credentials object so per-thread Google clients stay cached
+    cached = current_app.extensions.get("google_creds")
+    if cached and cached[0] == tok["access_token"]:
+        return cached[1]
+    creds = credentials_from_token(tok)
+    current_app.extensions["google_creds"] = (tok["access_token"], creds)
+    return creds
+
+def _poll_once(creds):
+    try:
+        sync_calendar(creds)
+    except Exception as e:
+        current_app.logger.warning(f"[Polling] Calendar sync failed: {e}")
+        db.session.rollback()
+
+    svc = google_service("gmail", "v1", creds)
+    now = datetime.now()
 
-                    task.status = "completed"
-                    db.session.commit()
+    tasks = [
+        t for t in Task.query.filter_by(status="waiting_for_slot").all()
+        if t.parameters.get("thread_id")
+    ]
+    threads = fetch_concurrently(creds, [
+        svc.users().threads().get(
+            userId="me", id=t.parameters["thread_id"], format="full"
+        )
+        for t in tasks
+    ])
+    for task, thread in zip(tasks, threads):
+        params   = task.parameters
+        thread_id = params.get("thread_id")
+        if thread is None:
+            current_app.logger.warning(f"[Polling] Couldn’t fetch thread {thread_id}")
+            continue
+
+        messages = thread.get("messages", [])
+        if len(messages) <= 1:
+            current_app.logger.info(f"[Polling] No reply yet for thread {thread_id}")
+            continue
+
+        raw_snip = messages[-1].get("snippet", "")
+        cleaned  = clean_reply(raw_snip)
+        current_app.logger.info(f"[Polling] Cleaned reply for {thread_id}: {cleaned}")
+
+        started = time.perf_counter()
+        slot_dt, path = match_reply(cleaned, params.get("offered_slots"), now)
+        current_app.logger.info(
+            f"[Polling] Slot parse via {path} in {(time.perf_counter() - started) * 1000:.1f}ms"
+        )
+        if not slot_dt:
+            current_app.logger.warning(f"[Polling] Couldn’t parse slot from: {cleaned}")
+            continue
+
+        if slot_dt < now:
+            slot_dt = slot_dt.replace(year=now.year + 1)
+        start_iso = slot_dt.isoformat()
+        end_iso   = (slot_dt + timedelta(hours=1)).isoformat()
+
+        orig = params.get("original_args", {})
+        summary   = orig.get("summary")
+        attendees = orig.get("attendees", [])
+        if not summary:
+            current_app.logger.error(
+                f"[Polling] Missing summary in task.parameters: {params}"
+            )
+            continue
 
-            time.sleep(interval)
+        current_app.logger.info(
+            f"[Polling] Scheduling '{summary}' at {start_iso}"
+        )
+        try:
+            ev = _create_event_internal({
+                "summary":   summary,
+                "attendees": attendees,
+                "start":     start_iso,
+                "end":       end_iso,
+                "creator_email": params.get("creator_email")
+            })
+        except Exception as e:
+            current_app.logger.error(f"[Polling] Couldn’t create event for {thread_id}: {e}")
+            continue
+        current_app.logger.info(
+            f"[Polling] Event created: id={ev.get('id')}"
+        )
 
-def start_polling_thread():
-    threading.Thread(target=_poll_for_slot_tasks, daemon=True).start()
+        task.status = "completed"
+        db.session.commit()
 
-@app.route("/")
+def _poll_for_slot_tasks(app):
+    interval = app.config["POLL_INTERVAL_SECONDS"]
+    while True:
+        # A fresh app context per round hands the pooled connection back while sleeping
+        with app.app_context():
+            if app.config.get("GOOGLE_TOKEN"):
+                try:
+                    _poll_once(_get_creds_from_config())
+                except Exception as e:
+                    current_app.logger.error(f"[Polling] Round failed: {e}")
+                    db.session.rollback()
+        time.sleep(interval)
+
+def start_polling_thread(app):
+    threading.Thread(target=_poll_for_slot_tasks, args=(app,), daemon=True).start()
+
+_backfill_lock = threading.Lock()
+
+def _run_backfill(app, creds):
+    if not _backfill_lock.acquire(blocking=False):
+        return
+    try:
+        with app.app_context():
+            backfill_gmail(creds)
+    except Exception as e:
+        app.logger.error(f"[Backfill] Stopped, will resume on next login: {e}")
+    finally:
+        _backfill_lock.release()
+
+def start_backfill_thread(creds):
+    app = current_app._get_current_object()
+    threading.Thread(target=_run_backfill, args=(app, creds), daemon=True).start()
+
+@bp.route("/")
 def index():
-    return redirect(url_for("chat_ui"))
+    return redirect(url_for("main.chat_ui"))
 
-@app.route("/chat_ui")
+@bp.route("/chat_ui")
 def chat_ui():
     if not session.get("user"):
-        return redirect(url_for("login"))
+        return redirect(url_for("main.login"))
     return render_template("index.html")
 
-@app.route("/login")
+@bp.route("/login")
 def login():
-    return oauth.google.authorize_redirect(url_for("auth_callback", _external=True))
+    return _oauth().google.authorize_redirect(url_for("main.auth_callback", _external=True))
 
-@app.route("/auth/callback")
+@bp.route("/auth/callback")
 def auth_callback():
-    token = oauth.google.authorize_access_token()
+    token = _oauth().google.authorize_access_token()
     session["google_token"] = token
-    app.config["GOOGLE_TOKEN"] = token
+    current_app.config["GOOGLE_TOKEN"] = token
 
     creds = _get_creds_from_config()
     ingest_gmail(creds)
-    ingest_calendar(creds)
+    sync_calendar(creds)
+    start_backfill_thread(creds)
 
     userinfo = token.get("userinfo", {})
     session["user"] = {"email": userinfo.get("email"), "name": userinfo.get("name")}
-    return redirect(url_for("chat_ui"))
+    return redirect(url_for("main.chat_ui"))
+
+def _propose_slots(days=3, hours=(9, 11, 14, 16)):
+    """Free one-hour slots over the next few days, from the primary calendar's free/busy."""
+    creds = _get_creds_from_config()
+    cal_service = google_service("calendar", "v3", creds)
+    now = datetime.utcnow()
+
+    fbq = freebusy_query(now, days)
+    current_app.logger.debug(f"Freebusy query body: {fbq}")
+    fb_res = google_execute(cal_service.freebusy().query(body=fbq))
+    busy = fb_res["calendars"]["primary"]["busy"]
+    current_app.logger.debug(f"Busy intervals: {busy}")
+
+    slots = free_slots(busy, now, days, hours)
+    current_app.logger.info(f"Computed available slots: {slots}")
+    return slots
 
-@app.route("/chat", methods=["POST"])
+@bp.route("/chat", methods=["POST"])
 def chat():
-    pending = Task.query.filter_by(status="awaiting_contact").first()
+    pending = pending_contact()
     if pending:
+        task_id, orig = pending
         email_addr = request.json.get("message", "").strip()
         if "@" not in email_addr:
             return Response(
@@ -195,30 +387,16 @@ def chat():
                 mimetype="text/plain"
             )
 
-        orig = pending.parameters["original_args"]
-        pending.task_type = "schedule_event"
-        pending.parameters = {
-            "summary":   orig["summary"],
-            "attendees": [email_addr],
-            "creator_email": session["user"]["email"]
-        }
-        pending.status = "waiting_for_slot"
-        db.session.commit()
-
-        # PATCHED: pass string, not list
+        slots = _propose_slots()
         sent = _send_email_internal({
             "to":      email_addr,
             "subject": f"Availability for {orig['summary']}",
-            "body":    (
-                "Hi,\n\n"
-                "Here are my available slots:\n"
-                "- Monday 9am\n"
-                "- Tuesday 2pm\n\n"
-                "Please let me know which works for you.\n\nThanks!"
-            )
+            "body":    availability_email(slots)
         })
-        pending.parameters["thread_id"] = sent["threadId"]
-        db.session.commit()
+        await_slot_reply(
+            {**orig, "attendees": [email_addr]}, sent["threadId"],
+            session["user"]["email"], slots, task_id=task_id
+        )
 
         return Response(
             f"✅ Thanks! Emailed availability to {email_addr}—will schedule once they reply.",
@@ -227,76 +405,17 @@ def chat():
 
     user_msg = request.json.get("message", "")
 
-    docs    = get_top_k_docs(user_msg)
-    context = "\n\n".join(d["content"] for d in docs)
-
-    messages = [
-        {"role": "system",  "content": RULES_TEXT},
-        {"role": "system",  "content": f"Context:\n{context}"},
-        {"role": "user",    "content": user_msg}
-    ]
+    docs     = get_top_k_docs(user_msg)
+    messages = build_messages(user_msg, docs)
 
-    functions = [
-        {
-            "name": "send_email",
-            "description": "Send an email via Gmail API",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "to":      {"type": "string"},
-                    "subject": {"type": "string"},
-                    "body":    {"type": "string"}
-                },
-                "required": ["to", "subject", "body"]
-            }
-        },
-        {
-            "name": "create_event",
-            "description": "Create a calendar event",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "summary":   {"type": "string"},
-                    "start":     {"type": "string"},
-                    "end":       {"type": "string"},
-                    "attendees": {"type": "array", "items": {"type": "string"}}
-                },
-                "required": ["summary"]
-            }
-        },
-        {
-            "name": "create_instruction",
-            "description": "Save a new ongoing instruction for proactive workflows",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                "trigger": {
-                    "type": "string",
-                    "description": "The event to watch for, e.g. 'email_from_unknown' or 'calendar_event_created'"
-                },
-                "action": {
-                    "type": "string",
-                    "description": "The action to take, e.g. 'email_attendees' or 'create_contact_with_note'"
-                },
-                "parameters": {
-                    "type": "object",
-                    "description": "Any extra key/value settings for this instruction"
-                }
-                },
-                "required": ["trigger", "action"]
-            }
-            }
-    ]
-    user_msg = request.json["message"]
-    if user_msg.lower().startswith("schedule"):
-        fc = {"name": "create_event"}      
-    else:
-        fc = "auto"
+    fc = function_call_for(user_msg)
     print(f"[Chat] Function call: {fc}")
-    resp = openai.ChatCompletion.create(
-        model="gpt-4-0613",
+    resp = chat_call(
+        _openai().ChatCompletion.create,
+        completion_tokens(messages),
+        model=CHAT_MODEL,
         messages=messages,
-        functions=functions,
+        functions=FUNCTIONS,
         function_call=fc
     )
     msg = resp["choices"][0]["message"]
@@ -314,21 +433,11 @@ def chat():
             )
 
         if fn_name == "create_event":
-            import re
-            from sqlalchemy import or_
-            from datetime import datetime, timedelta
-            from googleapiclient.discovery import build
-
             current_app.logger.info("🟢 Entered create_event")
 
             # 1) Determine attendee(s)
-            attendees = args.get("attendees") or []
-            current_app.logger.debug(f"Raw attendees arg: {attendees}")
-            if not attendees:
-                m = re.search(r"[Ww]ith\s+(.+)$", args.get("summary", ""))
-                if m:
-                    attendees = [m.group(1).strip()]
-                    current_app.logger.info(f"Extracted attendee from summary: {attendees}")
+            current_app.logger.debug(f"Raw attendees arg: {args.get('attendees')}")
+            attendees = requested_attendees(args)
             if not attendees:
                 current_app.logger.warning("No attendees found; prompting user")
                 return Response(
@@ -346,28 +455,14 @@ def chat():
                     resolved.append(name)
                     continue
 
-                contact = (
-                    Email.query
-                         .filter(or_(
-                             Email.sender_name.ilike(f"%{name}%"),
-                             Email.sender.ilike(f"%{name}%")
-                         ))
-                         .order_by(Email.date.desc())
-                         .first()
-                )
+                contact = find_contact(name)
                 if contact:
-                    current_app.logger.info(f"Resolved '{name}' → {contact.sender}")
-                    resolved.append(contact.sender)
+                    current_app.logger.info(f"Resolved '{name}' → {contact}")
+                    resolved.append(contact)
                 else:
                     current_app.logger.error(f"Could not resolve '{name}' to an email")
-                    task = Task(
-                        task_type="schedule_event",
-                        parameters={"original_args": args},
-                        status="awaiting_contact"
-                    )
-                    db.session.add(task)
-                    db.session.commit()
-                    current_app.logger.info(f"Enqueued awaiting_contact task id={task.id}")
+                    task_id = await_contact(args)
+                    current_app.logger.info(f"Enqueued awaiting_contact task id={task_id}")
                     return Response(
                         f"I don’t have an email for '{name}'. Could you please provide it?",
                         mimetype="text/plain"
@@ -387,43 +482,8 @@ def chat():
 
             # 4) Otherwise, fetch real free/busy & email slots
             current_app.logger.info("No start time—fetching free/busy for next 3 days")
-            creds = _get_creds_from_config()
-            cal_service = build("calendar", "v3", credentials=creds)
-            now = datetime.utcnow()
-
-            fbq = {
-                "timeMin": now.isoformat() + "Z",
-                "timeMax": (now + timedelta(days=3)).isoformat() + "Z",
-                "items": [{"id": "primary"}]
-            }
-            current_app.logger.debug(f"Freebusy query body: {fbq}")
-            fb_res = cal_service.freebusy().query(body=fbq).execute()
-            busy = fb_res["calendars"]["primary"]["busy"]
-            current_app.logger.debug(f"Busy intervals: {busy}")
-
-            def is_free(s, e):
-                for iv in busy:
-                    bs = datetime.fromisoformat(iv["start"].replace("Z", ""))
-                    be = datetime.fromisoformat(iv["end"].replace("Z", ""))
-                    if s < be and e > bs:
-                        return False
-                return True
-
-            slots = []
-            for d in range(3):
-                day = now + timedelta(days=d)
-                for h in (9, 11, 14, 16):
-                    start_dt = day.replace(hour=h, minute=0, second=0, microsecond=0)
-                    end_dt = start_dt + timedelta(hours=1)
-                    if is_free(start_dt, end_dt):
-                        slots.append(start_dt)
-            current_app.logger.info(f"Computed available slots: {slots}")
-
-            # format and send email
-            lines = ["Hi,\nHere are my available slots for the next 3 days:"]
-            lines += [f"- {dt.strftime('%A, %B %d at %I:%M %p')}" for dt in slots]
-            lines.append("\nPlease let me know which works for you.\nThanks!")
-            email_body = "\n".join(lines)
+            slots = _propose_slots()
+            email_body = availability_email(slots)
             current_app.logger.debug(f"Email body:\n{email_body}")
 
             to_addr = resolved[0] if len(resolved) == 1 else ", ".join(resolved)
@@ -434,18 +494,8 @@ def chat():
             })
             current_app.logger.info(f"Sent availability email, threadId={sent.get('threadId')}")
 
-            task = Task(
-                task_type="schedule_event",
-                parameters={
-                    "original_args": args,
-                    "thread_id":     sent["threadId"],
-                    "creator_email": session["user"]["email"]
-                },
-                status="waiting_for_slot"
-            )
-            db.session.add(task)
-            db.session.commit()
-            current_app.logger.info(f"Enqueued waiting_for_slot task id={task.id}")
+            task_id = await_slot_reply(args, sent["threadId"], session["user"]["email"], slots)
+            current_app.logger.info(f"Enqueued waiting_for_slot task id={task_id}")
 
             return Response(
                 f"✅ Emailed availability to {to_addr}—will schedule once they reply.",
@@ -454,61 +504,41 @@ def chat():
     # plain-text fallback
     return Response(msg.get("content", ""), mimetype="text/plain")
 
-@app.route("/logout")
+@bp.route("/metrics/db")
+def db_metrics():
+    return pool_stats(db.engine)
+
+@bp.route("/metrics/slot_parser")
+def slot_parser_metrics():
+    return slot_parser_stats()
+
+@bp.route("/logout")
 def logout():
     session.clear()
-    return redirect(url_for("chat_ui"))
+    return redirect(url_for("main.chat_ui"))
 
 def _send_email_internal(args):
     current_app.logger.info(f"Sending email with args: {args}")
     to_field = args["to"]
-    from sqlalchemy import or_
-
     if "@" not in to_field:
-        contact = (
-            Email.query
-                 .filter(or_(
-                     Email.sender_name.ilike(f"%{to_field}%"),
-                     Email.sender.ilike(f"%{to_field}%")
-                 ))
-                 .order_by(Email.date.desc())
-                 .first()
-        )
-        if contact:
-            to_field = contact.sender
-        else:
+        to_field = find_contact(to_field)
+        if not to_field:
             raise ValueError(f"Unknown contact: {args['to']}")
 
     creds   = _get_creds_from_config()
-    service = build("gmail", "v1", credentials=creds)
-    mime    = MIMEText(args["body"])
-    mime["to"]      = to_field
-    mime["subject"] = args["subject"]
-    raw_msg = base64.urlsafe_b64encode(mime.as_bytes()).decode()
-    return service.users().messages().send(userId="me", body={"raw": raw_msg}).execute()
+    service = google_service("gmail", "v1", creds)
+    raw_msg = raw_message(to_field, args["subject"], args["body"])
+    return google_execute(service.users().messages().send(userId="me", body={"raw": raw_msg}))
 
 def _create_event_internal(args):
     current_app.logger.info(f"Creating event with args: {args}")
-    user_tz = "America/Los_Angeles"
-    now = datetime.now()
-    from sqlalchemy import or_
-
     attendees = []
     for a in args.get("attendees", []):
         if "@" not in a:
-            contact = (
-                Email.query
-                     .filter(or_(
-                         Email.sender_name.ilike(f"%{a}%"),
-                         Email.sender.ilike(f"%{a}%")
-                     ))
-                     .order_by(Email.date.desc())
-                     .first()
-            )
-            if contact:
-                attendees.append(contact.sender)
-            else:
+            contact = find_contact(a)
+            if not contact:
                 raise ValueError(f"Unknown contact: {a}")
+            attendees.append(contact)
         else:
             attendees.append(a)
     creator = args.get("creator_email")
@@ -517,28 +547,15 @@ def _create_event_internal(args):
     else:
         attendees.insert(0, session["user"]["email"])
 
-    start_dt = date_parse(args["start"], default=now)
-    end_dt   = date_parse(args["end"],   default=now)
-    if start_dt < now:
-        start_dt = start_dt.replace(year=now.year+1)
-    if end_dt < now:
-        end_dt = end_dt.replace(year=now.year+1)
-
-    start_iso = start_dt.isoformat()
-    end_iso   = end_dt.isoformat()
-
     creds   = _get_creds_from_config()
-    service = build("calendar", "v3", credentials=creds)
-    event_body = {
-        "summary":   args["summary"],
-        "start":     {"dateTime": start_iso, "timeZone": user_tz},
-        "end":       {"dateTime": end_iso,   "timeZone": user_tz},
-        "attendees": [{"email": e} for e in attendees]
-    }
-    return service.events().insert(calendarId="primary", body=event_body).execute()
+    service = google_service("calendar", "v3", creds)
+    body    = event_body(args["summary"], args["start"], args["end"], attendees)
+    return google_execute(service.events().insert(calendarId="primary", body=body))
 
 if __name__ == "__main__":
-    start_polling_thread()
+    app = create_app()
+    init_schema(app)
+    start_polling_thread(app)
     app.run(
         host="0.0.0.0",
         port=int(os.getenv("PORT", 8000)),
@@ -0,0 +1,219 @@
+"""Async serving mode: /chat runs on the event loop, everything else is the Flask app.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+A conversation waiting on OpenAI or Google holds no thread, so one process
+serves many at once. Outbound calls share keep-alive connection pools and the
+process-wide quota gates; database work runs on a threadpool sized to the
+connection pool.
+"""
+import json
+import os
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import anyio
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import PlainTextResponse
+from starlette.routing import Mount, Route
+
+from app import create_app, init_schema, start_polling_thread
+from async_clients import AsyncGoogle, AsyncOpenAI
+from chat import (
+    CHAT_MODEL, FUNCTIONS, availability_email, await_contact, await_slot_reply,
+    build_messages, completion_tokens, event_body, find_contact, free_slots,
+    freebusy_query, function_call_for, pending_contact, raw_message, requested_attendees
+)
+from database import MAX_OVERFLOW, POOL_SIZE
+from google_clients import credentials_from_token
+from vectorstore import active_version, search_by_vector
+
+flask_app = create_app()
+
+async def _db(fn, *args):
+    """Run `fn` on the threadpool inside an app context, so the loop never waits on the database."""
+    def run():
+        with flask_app.app_context():
+            return fn(*args)
+    return await run_in_threadpool(run)
+
+def _flask_session(request):
+    """Decode Flask's signed session cookie, so both halves share one login."""
+    serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+    cookie = request.cookies.get(flask_app.config["SESSION_COOKIE_NAME"])
+    if serializer is None or not cookie:
+        return {}
+    try:
+        return serializer.loads(
+            cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds())
+        )
+    except BadSignature:
+        return {}
+
+CREDENTIALS_CACHE_SIZE = int(os.getenv("CREDENTIALS_CACHE_SIZE", 256))
+_creds = OrderedDict()
+
+def _credentials(sess):
+    tok = sess.get("google_token") or flask_app.config.get("GOOGLE_TOKEN")
+    if not tok:
+        raise RuntimeError("Google token not found in session or app.config")
+    # Keep one Credentials per token so a refresh carries over to later requests;
+    # least recently used first out, since every login brings a new access token
+    key = tok["access_token"]
+    if key in _creds:
+        _creds.move_to_end(key)
+    else:
+        _creds[key] = credentials_from_token(tok)
+        while len(_creds) > CREDENTIALS_CACHE_SIZE:
+            _creds.popitem(last=False)
+    return _creds[key]
+
+async def _propose_slots(google, creds, days=3, hours=(9, 11, 14, 16)):
+    now = datetime.utcnow()
+    fb_res = await google.freebusy(creds, freebusy_query(now, days))
+    return free_slots(fb_res["calendars"]["primary"]["busy"], now, days, hours)
+
+async def _send_email(google, creds, args):
+    to_field = args["to"]
+    if "@" not in to_field:
+        to_field = await _db(find_contact, to_field)
+        if not to_field:
+            raise ValueError(f"Unknown contact: {args['to']}")
+    return await google.send_message(creds, raw_message(to_field, args["subject"], args["body"]))
+
+async def _create_event(google, creds, args, user_email):
+    attendees = []
+    for a in args.get("attendees", []):
+        if "@" not in a:
+            contact = await _db(find_contact, a)
+            if not contact:
+                raise ValueError(f"Unknown contact: {a}")
+            attendees.append(contact)
+        else:
+            attendees.append(a)
+    attendees.insert(0, args.get("creator_email") or user_email)
+    body = event_body(args["summary"], args["start"], args["end"], attendees)
+    return await google.insert_event(creds, body)
+
+async def chat_endpoint(request):
+    payload = await request.json()
+    sess = _flask_session(request)
+    user_email = (sess.get("user") or {}).get("email")
+    openai_client, google = request.app.state.openai, request.app.state.google
+
+    pending = await _db(pending_contact)
+    if pending:
+        task_id, orig = pending
+        email_addr = payload.get("message", "").strip()
+        if "@" not in email_addr:
+            return PlainTextResponse(
+                "That doesn’t look like an email address. Please send a valid one, e.g. alice@example.com."
+            )
+        creds = _credentials(sess)
+        slots = await _propose_slots(google, creds)
+        sent = await _send_email(google, creds, {
+            "to":      email_addr,
+            "subject": f"Availability for {orig['summary']}",
+            "body":    availability_email(slots)
+        })
+        await _db(
+            await_slot_reply, {**orig, "attendees": [email_addr]}, sent["threadId"],
+            user_email, slots, task_id
+        )
+        return PlainTextResponse(
+            f"✅ Thanks! Emailed availability to {email_addr}—will schedule once they reply."
+        )
+
+    user_msg = payload.get("message", "")
+    # Embed with the active version's model and search that same version
+    config = await run_in_threadpool(active_version)
+    query_vector = (await openai_client.embed([user_msg], config))[0]
+    docs = await _db(search_by_vector, query_vector, 5, None, config)
+    messages = build_messages(user_msg, docs)
+
+    resp = await openai_client.chat(
+        completion_tokens(messages),
+        model=CHAT_MODEL,
+        messages=messages,
+        functions=FUNCTIONS,
+        function_call=function_call_for(user_msg)
+    )
+    msg = resp["choices"][0]["message"]
+
+    if msg.get("function_call"):
+        fn_name = msg["function_call"]["name"]
+        args    = json.loads(msg["function_call"]["arguments"])
+
+        if fn_name == "send_email":
+            await _send_email(google, _credentials(sess), args)
+            return PlainTextResponse(f"✅ Email sent to {args['to']}.")
+
+        if fn_name == "create_event":
+            attendees = requested_attendees(args)
+            if not attendees:
+                return PlainTextResponse("Who should attend this meeting? Please provide a name or email.")
+            args["attendees"] = attendees
+
+            resolved = []
+            for name in attendees:
+                if "@" in name:
+                    resolved.append(name)
+                    continue
+                contact = await _db(find_contact, name)
+                if not contact:
+                    await _db(await_contact, args)
+                    return PlainTextResponse(
+                        f"I don’t have an email for '{name}'. Could you please provide it?"
+                    )
+                resolved.append(contact)
+            args["attendees"] = resolved
+
+            creds = _credentials(sess)
+            if args.get("start"):
+                await _create_event(google, creds, args, user_email)
+                return PlainTextResponse(f"✅ Event '{args['summary']}' scheduled on {args['start']}.")
+
+            slots = await _propose_slots(google, creds)
+            to_addr = resolved[0] if len(resolved) == 1 else ", ".join(resolved)
+            sent = await _send_email(google, creds, {
+                "to":      to_addr,
+                "subject": f"Availability for {args['summary']}",
+                "body":    availability_email(slots)
+            })
+            await _db(await_slot_reply, args, sent["threadId"], user_email, slots)
+            return PlainTextResponse(
+                f"✅ Emailed availability to {to_addr}—will schedule once they reply."
+            )
+    # plain-text fallback
+    return PlainTextResponse(msg.get("content") or "")
+
+@asynccontextmanager
+async def lifespan(app):
+    # More DB threads than pooled connections would only queue on the pool
+    anyio.to_thread.current_default_thread_limiter().total_tokens = POOL_SIZE + MAX_OVERFLOW
+    app.state.openai = AsyncOpenAI(flask_app.config["OPENAI_API_KEY"])
+    app.state.google = AsyncGoogle()
+    await run_in_threadpool(init_schema, flask_app)
+    if os.getenv("ASGI_POLLER", "0") == "1":
+        start_polling_thread(flask_app)
+    try:
+        yield
+    finally:
+        await app.state.openai.aclose()
+        await app.state.google.aclose()
+
+app = Starlette(
+    routes=[
+        Route("/chat", chat_endpoint, methods=["POST"]),
+        Mount("/", app=WSGIMiddleware(flask_app)),
+    ],
+    lifespan=lifespan,
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run("asgi:app", host="0.0.0.0", port=int(os.getenv("PORT", 8000)))
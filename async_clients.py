@@ -0,0 +1,95 @@
+import os
+import httpx
+from starlette.concurrency import run_in_threadpool
+from ratelimit import GMAIL_QUOTA_UNITS, calendar, chat_gate, estimate_tokens, gmail
+
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+GMAIL_API = "https://gmail.googleapis.com/gmail/v1"
+CALENDAR_API = "https://www.googleapis.com/calendar/v3"
+
+# One keep-alive pool per upstream, shared by every conversation the process serves
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 100))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", 20))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", 60))
+GOOGLE_TIMEOUT = float(os.getenv("GOOGLE_TIMEOUT", 15))
+
+def _client(timeout, **kwargs):
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=30,
+        ),
+        timeout=httpx.Timeout(timeout, connect=5),
+        **kwargs,
+    )
+
+class AsyncOpenAI:
+    """Chat completions and embeddings over the REST API, under the chat quota gate."""
+
+    def __init__(self, api_key):
+        self._http = _client(
+            OPENAI_TIMEOUT, base_url=OPENAI_API_BASE,
+            headers={"Authorization": f"Bearer {api_key}"},
+        )
+
+    async def _post(self, path, payload, tokens):
+        async def send():
+            resp = await self._http.post(path, json=payload)
+            resp.raise_for_status()
+            return resp.json()
+        return await chat_gate.call_async(send, cost=tokens)
+
+    async def embed(self, texts, config):
+        """Embed `texts` with the model of index version `config`."""
+        texts = list(texts)
+        payload = {"input": texts, "model": config.model}
+        if config.dimensions:
+            payload["dimensions"] = config.dimensions
+        data = await self._post("/embeddings", payload, estimate_tokens(texts))
+        return [d["embedding"] for d in sorted(data["data"], key=lambda d: d["index"])]
+
+    async def chat(self, tokens, **payload):
+        return await self._post("/chat/completions", payload, tokens)
+
+    async def aclose(self):
+        await self._http.aclose()
+
+class AsyncGoogle:
+    """The Gmail and Calendar calls behind chat actions, as plain REST requests."""
+
+    def __init__(self):
+        self._http = _client(GOOGLE_TIMEOUT)
+
+    async def _request(self, gate, cost, creds, method, url, **kwargs):
+        async def send():
+            resp = await self._http.request(
+                method, url, headers={"Authorization": f"Bearer {creds.token}"}, **kwargs
+            )
+            if resp.status_code == 401 and creds.refresh_token:
+                # Expired access token: refresh off the event loop and try once more
+                from google.auth.transport.requests import Request
+                await run_in_threadpool(creds.refresh, Request())
+                resp = await self._http.request(
+                    method, url, headers={"Authorization": f"Bearer {creds.token}"}, **kwargs
+                )
+            resp.raise_for_status()
+            return resp.json()
+        return await gate.call_async(send, cost=cost)
+
+    async def send_message(self, creds, raw):
+        return await self._request(
+            gmail, GMAIL_QUOTA_UNITS["gmail.users.messages.send"], creds,
+            "POST", f"{GMAIL_API}/users/me/messages/send", json={"raw": raw},
+        )
+
+    async def insert_event(self, creds, body):
+        return await self._request(
+            calendar, 1, creds, "POST", f"{CALENDAR_API}/calendars/primary/events", json=body,
+        )
+
+    async def freebusy(self, creds, body):
+        return await self._request(calendar, 1, creds, "POST", f"{CALENDAR_API}/freeBusy", json=body)
+
+    async def aclose(self):
+        await self._http.aclose()
@@ -0,0 +1,230 @@
+import io
+import multiprocessing
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from html.parser import HTMLParser
+from xml.etree import ElementTree
+
+# Extraction is CPU-bound (PDF layout, spreadsheets), so it runs in worker
+# processes rather than on the ingest threads
+EXTRACT_WORKERS = int(os.getenv("ATTACHMENT_WORKERS", max(1, (os.cpu_count() or 2) - 1)))
+MAX_ATTACHMENT_BYTES = int(os.getenv("MAX_ATTACHMENT_BYTES", 15 * 1024 * 1024))
+MAX_ATTACHMENT_CHARS = 100_000
+# Attachment bytes held in memory at once, fetched or queued for a worker; keeps
+# a page of large attachments from being decoded and pickled all together
+MAX_INFLIGHT_BYTES = int(os.getenv("ATTACHMENT_INFLIGHT_BYTES", 4 * MAX_ATTACHMENT_BYTES))
+# A malformed file can send a parser into a loop; give up on it after this long
+EXTRACT_TIMEOUT = float(os.getenv("ATTACHMENT_EXTRACT_TIMEOUT", 120))
+
+PDF = "application/pdf"
+XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+DOCX = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+_EXTENSIONS = {
+    ".pdf": PDF, ".xlsx": XLSX, ".docx": DOCX,
+    ".csv": "text/csv", ".txt": "text/plain", ".html": "text/html", ".htm": "text/html",
+}
+
+def walk_parts(payload):
+    """Yield every MIME part of a Gmail payload, depth first, starting with the payload itself."""
+    yield payload
+    for part in payload.get("parts") or []:
+        yield from walk_parts(part)
+
+class _TextExtractor(HTMLParser):
+    _SKIP = {"script", "style", "head", "title"}
+    _BLOCK = {"p", "div", "br", "tr", "li", "h1", "h2", "h3", "h4", "h5", "h6", "table", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.chunks = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self._SKIP:
+            self._skipping += 1
+        elif tag in self._BLOCK:
+            self.chunks.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in self._SKIP:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in self._BLOCK:
+            self.chunks.append("\n")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.chunks.append(data)
+
+def html_to_text(html):
+    parser = _TextExtractor()
+    parser.feed(html or "")
+    parser.close()
+    lines = (" ".join(line.split()) for line in "".join(parser.chunks).split("\n"))
+    return "\n".join(line for line in lines if line)
+
+def mime_type_of(mime_type, filename):
+    """Trust the declared type unless it's generic, then go by the file extension."""
+    if mime_type and mime_type != "application/octet-stream":
+        return mime_type
+    return _EXTENSIONS.get(os.path.splitext(filename or "")[1].lower(), mime_type)
+
+def _decode(data):
+    return data.decode("utf-8", errors="replace")
+
+def _pdf(data):
+    from pypdf import PdfReader
+    reader = PdfReader(io.BytesIO(data))
+    return "\n".join(page.extract_text() or "" for page in reader.pages)
+
+def _xlsx(data):
+    from openpyxl import load_workbook
+    workbook = load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    lines = []
+    for sheet in workbook.worksheets:
+        lines.append(f"Sheet: {sheet.title}")
+        for row in sheet.iter_rows(values_only=True):
+            cells = [str(value) for value in row if value is not None]
+            if cells:
+                lines.append(" | ".join(cells))
+    workbook.close()
+    return "\n".join(lines)
+
+def _docx(data):
+    ns = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        root = ElementTree.fromstring(archive.read("word/document.xml"))
+    return "\n".join(
+        "".join(node.text or "" for node in para.iter(f"{ns}t"))
+        for para in root.iter(f"{ns}p")
+    )
+
+_EXTRACTORS = {
+    PDF: _pdf,
+    XLSX: _xlsx,
+    DOCX: _docx,
+    "text/plain": _decode,
+    "text/csv": _decode,
+    "text/html": lambda data: html_to_text(_decode(data)),
+}
+
+def is_supported(mime_type):
+    return mime_type in _EXTRACTORS
+
+def extract_text(mime_type, data):
+    """Plain text of an attachment; runs inside a worker process."""
+    text = _EXTRACTORS[mime_type](data)
+    return text.strip()[:MAX_ATTACHMENT_CHARS]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # The ingest side is multi-threaded and holds DB connections; spawned
+                # workers start clean instead of inheriting that state through fork
+                _pool = ProcessPoolExecutor(
+                    max_workers=EXTRACT_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+    return _pool
+
+class _ByteBudget:
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        with self._cond:
+            # An attachment larger than the whole budget still goes through, alone
+            while self.used and self.used + size > self.limit:
+                self._cond.wait()
+            self.used += size
+
+    def release(self, size):
+        with self._cond:
+            self.used -= size
+            self._cond.notify_all()
+
+_budget = _ByteBudget(MAX_INFLIGHT_BYTES)
+# future -> (bytes it holds in the budget, pool it runs in), until it is released
+_held = {}
+_held_lock = threading.Lock()
+
+def _release(future):
+    with _held_lock:
+        entry = _held.pop(future, None)
+    if entry is not None:
+        _budget.release(entry[0])
+    return entry
+
+def _recycle_pool(pool):
+    """Kill `pool`'s workers and start later extractions on a fresh pool.
+
+    A worker stuck on one file would otherwise keep its slot forever. Extractions
+    still queued or running there fail with BrokenProcessPool and are retried on
+    the next ingest.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    kill = getattr(pool, "kill_workers", None)     # Python 3.14+
+    if kill is not None:
+        kill()
+    else:
+        for process in list((pool._processes or {}).values()):
+            process.kill()
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def batches(items, size_of, limit=MAX_INFLIGHT_BYTES):
+    """Split `items` into consecutive lists whose sizes add up to at most `limit` (one item at least)."""
+    batch, total = [], 0
+    for item in items:
+        size = size_of(item)
+        if batch and total + size > limit:
+            yield batch
+            batch, total = [], 0
+        batch.append(item)
+        total += size
+    if batch:
+        yield batch
+
+def submit(mime_type, data):
+    """Start extracting `data` in the worker pool and return the Future.
+
+    Blocks while MAX_INFLIGHT_BYTES of attachments are already waiting for or in
+    a worker; the executor keeps each payload until its result is back.
+    """
+    size = len(data)
+    _budget.acquire(size)
+    try:
+        pool = _get_pool()
+        future = pool.submit(extract_text, mime_type, data)
+    except BaseException:
+        _budget.release(size)
+        raise
+    with _held_lock:
+        _held[future] = (size, pool)
+    future.add_done_callback(_release)
+    return future
+
+def result(future, timeout=EXTRACT_TIMEOUT):
+    """The text a `submit` future extracts, waiting at most `timeout` seconds.
+
+    On timeout the worker is killed, the attachment's bytes go back to the
+    budget and TimeoutError is raised.
+    """
+    try:
+        return future.result(timeout=timeout)
+    except TimeoutError:
+        entry = _release(future)
+        if entry is not None:
+            _recycle_pool(entry[1])
+        raise
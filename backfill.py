@@ -0,0 +1,174 @@
+import queue
+import threading
+from typing import TYPE_CHECKING
+from flask import current_app
+from google_clients import google_service
+from models import db, SyncState, UNDATED
+from ingestion import (
+    collect_attachments, embed_attachments, embed_parsed, fetch_concurrently,
+    parse_message, write_attachments, write_messages
+)
+from partitions import ensure_month
+from ratelimit import google_execute
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+PAGE_SIZE = 100
+QUEUE_DEPTH = 2          # pages buffered between two stages
+CHECKPOINT_KEY = 'gmail:backfill'
+
+_DONE = object()
+
+class _Failed:
+    def __init__(self, error):
+        self.error = error
+
+def _put(q, item, stop):
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _threaded(source, stop, depth=QUEUE_DEPTH):
+    """Run generator `source` on its own thread, handing items over through a bounded queue.
+
+    A full queue blocks the producer, so at most `depth` pages sit between any two stages
+    no matter how large the mailbox is.
+    """
+    q = queue.Queue(maxsize=depth)
+
+    def pump():
+        try:
+            for item in source:
+                if not _put(q, item, stop):
+                    return
+            _put(q, _DONE, stop)
+        except Exception as e:
+            _put(q, _Failed(e), stop)
+
+    threading.Thread(target=pump, daemon=True).start()
+    while True:
+        try:
+            item = q.get(timeout=0.5)
+        except queue.Empty:
+            if stop.is_set():
+                return
+            continue
+        if item is _DONE:
+            return
+        if isinstance(item, _Failed):
+            raise item.error
+        yield item
+
+def list_pages(creds, page_token, page_size):
+    service = google_service('gmail', 'v1', creds)
+    while True:
+        resp = google_execute(service.users().messages().list(
+            userId='me', maxResults=page_size, pageToken=page_token
+        ))
+        next_token = resp.get('nextPageToken')
+        yield {'next_token': next_token, 'items': [m['id'] for m in resp.get('messages', [])]}
+        if not next_token:
+            return
+        page_token = next_token
+
+def fetch_pages(creds, pages):
+    service = google_service('gmail', 'v1', creds)
+    for page in pages:
+        fetched = fetch_concurrently(creds, [
+            service.users().messages().get(userId='me', id=msg_id, format='full')
+            for msg_id in page['items']
+        ])
+        missing = sum(1 for msg in fetched if msg is None)
+        if missing:
+            print(f"[Backfill] Skipping {missing} messages that couldn't be fetched")
+        yield {**page, 'items': [msg for msg in fetched if msg is not None]}
+
+def attachment_pages(app, creds, pages):
+    """Fetch each page's attachments and hand their extraction to the process pool.
+
+    The futures travel with the page; by the time it reaches the embed stage most
+    of them have finished.
+    """
+    for page in pages:
+        with app.app_context():
+            attachments = collect_attachments(creds, page['items'])
+        yield {**page, 'attachments': attachments}
+
+def parse_pages(pages):
+    for page in pages:
+        yield {**page, 'items': [parse_message(msg) for msg in page['items']]}
+
+def embed_pages(pages):
+    for page in pages:
+        try:
+            vectors = embed_parsed(page['items'])
+        except Exception as e:
+            print(f"[Backfill] Embedding skipped for {len(page['items'])} emails: {e}")
+            vectors = None
+        embed_attachments(page['attachments'])
+        yield {**page, 'vectors': vectors}
+
+def backfill_gmail(creds: 'Credentials', page_size: int = PAGE_SIZE, restart: bool = False):
+    """Index the whole mailbox, resuming from the last committed page.
+
+    Stages run list -> fetch -> attachments -> parse -> embed concurrently; writes
+    and the checkpoint happen on the calling thread, which must hold an app context.
+    """
+    state = db.session.get(SyncState, CHECKPOINT_KEY)
+    if state is None:
+        state = SyncState(key=CHECKPOINT_KEY, processed=0)
+        db.session.add(state)
+    if restart:
+        state.cursor, state.status, state.processed = None, 'pending', 0
+    if state.status == 'complete':
+        print("[Backfill] Mailbox already backfilled.")
+        return
+    start_token = state.cursor
+    state.status = 'running'
+    db.session.commit()
+    if start_token:
+        print(f"[Backfill] Resuming after {state.processed} messages.")
+
+    stop = threading.Event()
+    pages = _threaded(list_pages(creds, start_token, page_size), stop)
+    pages = _threaded(fetch_pages(creds, pages), stop)
+    pages = _threaded(attachment_pages(current_app._get_current_object(), creds, pages), stop)
+    pages = _threaded(parse_pages(pages), stop)
+    pages = _threaded(embed_pages(pages), stop)
+    try:
+        for page in pages:
+            if page['vectors'] is None or any(
+                item['docs'] and item['vectors'] is None for item in page['attachments']
+            ):
+                # Past this page its messages would never be embedded; stop with the
+                # cursor still in front of it so the next run starts here
+                state = db.session.get(SyncState, CHECKPOINT_KEY)
+                state.status = 'failed'
+                db.session.commit()
+                print(f"[Backfill] Stopped: embedding failed; will resume after {state.processed} messages.")
+                return
+            # Pages run newest to oldest; give each older month its partition before
+            # its rows arrive, or the whole history piles up in the DEFAULT partition
+            dates = [email_rec.date for email_rec, _, _ in page['items'] if email_rec.date > UNDATED]
+            if dates:
+                try:
+                    ensure_month(min(dates))
+                except Exception as e:
+                    # The rows still land in the DEFAULT partition; `flask partitions ensure --since` fixes it up
+                    print(f"[Backfill] Couldn't create partitions back to {min(dates):%Y-%m}: {e}")
+            write_messages(page['items'], page['vectors'])
+            write_attachments(page['attachments'])
+
+            state = db.session.get(SyncState, CHECKPOINT_KEY)
+            state.cursor = page['next_token']
+            state.processed = (state.processed or 0) + len(page['items'])
+            state.status = 'running' if page['next_token'] else 'complete'
+            db.session.commit()
+            print(f"[Backfill] Committed page; {state.processed} messages so far.")
+    finally:
+        stop.set()
@@ -0,0 +1,123 @@
+"""Compare the float32, halfvec and binary vector layouts on a sample of `embeddings`.
+
+    python bench_quantization.py [--rows 20000] [--queries 100] [--k 10]
+
+Copies up to `--rows` stored vectors into a temp table and builds one HNSW index
+per layout. For each layout it reports the index size (what the ANN search needs
+resident in memory), the build time, recall@k against exact float32 search and
+the mean query latency. The quantized layouts rerank their candidates on the full
+vectors, as vectorstore.range_search does.
+"""
+import argparse
+import sys
+import time
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+D = 1536
+RERANKED = f"""
+    SELECT id FROM (
+        SELECT id, vector FROM bench_vectors
+        WHERE id <> :qid
+        ORDER BY {{order}}
+        LIMIT :candidates
+    ) c
+    ORDER BY vector <=> CAST(:q AS vector({D}))
+    LIMIT :k
+"""
+# name -> (index expression and opclass, ANN ordering, candidates per result)
+LAYOUTS = {
+    "float32": ("vector vector_cosine_ops", f"vector <=> CAST(:q AS vector({D}))", 1),
+    "halfvec": (
+        f"(vector::halfvec({D})) halfvec_cosine_ops",
+        f"vector::halfvec({D}) <=> CAST(:q AS halfvec({D}))", 4,
+    ),
+    "binary": (
+        f"(binary_quantize(vector)::bit({D})) bit_hamming_ops",
+        f"binary_quantize(vector)::bit({D}) <~> binary_quantize(CAST(:q AS vector({D})))", 10,
+    ),
+}
+
+def _exact(conn, queries, k):
+    truth = {}
+    for qid, q in queries:
+        rows = conn.execute(text(f"""
+            SELECT id FROM bench_vectors WHERE id <> :qid
+            ORDER BY vector <=> CAST(:q AS vector({D})) LIMIT :k
+        """), {"qid": qid, "q": q, "k": k})
+        truth[qid] = {row.id for row in rows}
+    return truth
+
+def _bench_layout(conn, name, queries, truth, k, factor_override):
+    index_expr, order, factor = LAYOUTS[name]
+    factor = factor_override or factor
+    start = time.perf_counter()
+    conn.execute(text(f"CREATE INDEX bench_{name} ON bench_vectors USING hnsw ({index_expr})"))
+    build = time.perf_counter() - start
+    size = conn.execute(text(f"SELECT pg_relation_size('bench_{name}')")).scalar()
+
+    candidates = k * factor
+    conn.execute(text(f"SET hnsw.ef_search = {max(40, candidates)}"))
+    # Small samples would otherwise be answered by a sequential scan
+    conn.execute(text("SET enable_seqscan = off"))
+    sql = text(RERANKED.format(order=order))
+    hits, elapsed = 0, 0.0
+    for qid, q in queries:
+        start = time.perf_counter()
+        rows = conn.execute(sql, {"qid": qid, "q": q, "candidates": candidates, "k": k})
+        found = {row.id for row in rows}
+        elapsed += time.perf_counter() - start
+        hits += len(found & truth[qid])
+    conn.execute(text("RESET enable_seqscan"))
+    conn.execute(text(f"DROP INDEX bench_{name}"))
+    return {
+        "index_mb": size / 2**20,
+        "build_s": build,
+        "recall": hits / (k * len(queries)),
+        "query_ms": 1000 * elapsed / len(queries),
+        "candidates": candidates,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factor", type=int, default=None,
+                        help="candidates per result for the quantized layouts")
+    args = parser.parse_args()
+
+    load_dotenv()
+    from database import get_engine, lift_statement_timeout
+    with get_engine().connect() as conn:
+        # Index builds on the sample take far longer than a request may
+        lift_statement_timeout(conn)
+        conn.execute(text(
+            "CREATE TEMP TABLE bench_vectors AS "
+            "SELECT id, vector FROM embeddings ORDER BY random() LIMIT :rows"
+        ), {"rows": args.rows})
+        conn.execute(text("ANALYZE bench_vectors"))
+        rows = conn.execute(text("SELECT count(*) FROM bench_vectors")).scalar()
+        if rows <= args.k:
+            print(f"Need more than {args.k} rows in embeddings, found {rows}.")
+            return 1
+        heap = conn.execute(text("SELECT pg_total_relation_size('bench_vectors')")).scalar()
+        queries = [tuple(r) for r in conn.execute(text(
+            "SELECT id, vector::text FROM bench_vectors ORDER BY random() LIMIT :n"
+        ), {"n": args.queries})]
+        truth = _exact(conn, queries, args.k)
+
+        print(f"{rows} vectors, {len(queries)} queries, k={args.k}; "
+              f"full-precision table {heap / 2**20:.1f} MB\n")
+        print(f"{'layout':<8} {'bytes/vec':>9} {'index MB':>9} {'build s':>8} "
+              f"{'recall@k':>9} {'query ms':>9} {'cands':>6}")
+        for name, bytes_per_vec in (("float32", 4 * D + 8), ("halfvec", 2 * D + 8), ("binary", D // 8 + 8)):
+            r = _bench_layout(conn, name, queries, truth, args.k,
+                              args.rerank_factor if name != "float32" else None)
+            print(f"{name:<8} {bytes_per_vec:>9} {r['index_mb']:>9.1f} {r['build_s']:>8.2f} "
+                  f"{r['recall']:>9.3f} {r['query_ms']:>9.2f} {r['candidates']:>6}")
+        conn.rollback()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
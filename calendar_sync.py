@@ -0,0 +1,200 @@
+import threading
+from datetime import datetime, timedelta
+from typing import TYPE_CHECKING
+from dateutil import parser as date_parser
+from google_clients import google_service
+from models import db, CalendarEvent, SyncState
+from documents import event_metadata, event_text
+from ingestion import active_version, embed_texts, store_embeddings, delete_embeddings
+from ratelimit import google_execute
+from thread_index import naive_utc
+
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+CALENDAR_ID = 'primary'
+SYNC_KEY = 'calendar:primary'
+WINDOW_KEY = 'calendar:window'
+# Recurring series are expanded into instances only inside this rolling window
+WINDOW_PAST = timedelta(days=30)
+WINDOW_FUTURE = timedelta(days=180)
+PAGE_SIZE = 250
+
+_sync_lock = threading.Lock()
+
+def _parse_when(when):
+    # Stored naive in UTC, like every other date the partitions and search compare against
+    raw = (when or {}).get('dateTime') or (when or {}).get('date')
+    return naive_utc(date_parser.parse(raw)) if raw else None
+
+def _window():
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - WINDOW_PAST, today + WINDOW_FUTURE
+
+def _state(key):
+    state = db.session.get(SyncState, key)
+    if state is None:
+        state = SyncState(key=key, processed=0)
+        db.session.add(state)
+    return state
+
+def _row(ev, recurring_event_id=None):
+    return CalendarEvent(
+        id=ev['id'],
+        summary=ev.get('summary'),
+        start=_parse_when(ev.get('start')),
+        end=_parse_when(ev.get('end')),
+        raw=ev,
+        recurring_event_id=recurring_event_id,
+        is_series=bool(ev.get('recurrence')),
+    )
+
+def _delete_events(ids):
+    CalendarEvent.query.filter(CalendarEvent.id.in_(ids)).delete(synchronize_session=False)
+    db.session.commit()
+    delete_embeddings('event', ids)
+
+def _apply(ev, to_embed, series):
+    """Apply one changed event from events.list; instances are left to _expand_series."""
+    if ev.get('status') == 'cancelled':
+        if ev.get('recurringEventId'):
+            _delete_events([ev['id']])
+        else:
+            instances = CalendarEvent.query.filter_by(recurring_event_id=ev['id']).all()
+            _delete_events([ev['id']] + [i.id for i in instances])
+        return
+
+    if ev.get('recurringEventId'):
+        # A moved or edited occurrence: refresh it together with the rest of its series
+        series.add(ev['recurringEventId'])
+        return
+
+    existing = db.session.get(CalendarEvent, ev['id'])
+    chunk_chars = active_version().chunk_chars
+    text = event_text(ev, chunk_chars)
+    if text and (existing is None or event_text(existing.raw or {}, chunk_chars) != text):
+        to_embed.append((ev['id'], text, event_metadata(ev['id'], _parse_when(ev.get('start')))))
+    db.session.merge(_row(ev))
+    if ev.get('recurrence'):
+        series.add(ev['id'])
+
+def _embed(to_embed):
+    if not to_embed:
+        return
+    try:
+        vectors = embed_texts([text for _, text, _ in to_embed])
+    except Exception as e:
+        print(f"[CalendarSync] Embedding skipped for {len(to_embed)} events: {e}")
+        return
+    store_embeddings('event', [
+        (event_id, text, vector, metadata)
+        for (event_id, text, metadata), vector in zip(to_embed, vectors)
+    ])
+
+def _pull(service, sync_token):
+    """Page through events.list, applying each page. Returns (next_sync_token, series_to_expand)."""
+    series, seen = set(), set()
+    page_token = None
+    while True:
+        params = dict(calendarId=CALENDAR_ID, maxResults=PAGE_SIZE, pageToken=page_token)
+        if sync_token:
+            params['syncToken'] = sync_token
+        resp = google_execute(service.events().list(**params))
+
+        to_embed = []
+        for ev in resp.get('items', []):
+            seen.add(ev['id'])
+            _apply(ev, to_embed, series)
+        db.session.commit()
+        _embed(to_embed)
+
+        page_token = resp.get('nextPageToken')
+        if not page_token:
+            break
+
+    if not sync_token:
+        # A full pull is authoritative: drop standalone events and series Google no longer has
+        gone = [
+            r.id for r in CalendarEvent.query.filter(CalendarEvent.recurring_event_id.is_(None))
+            if r.id not in seen
+        ]
+        if gone:
+            instances = CalendarEvent.query.filter(CalendarEvent.recurring_event_id.in_(gone)).all()
+            _delete_events(gone + [i.id for i in instances])
+    return resp.get('nextSyncToken'), series
+
+def _expand_series(service, series_id, window_start, window_end):
+    from googleapiclient.errors import HttpError
+    keep = set()
+    page_token = None
+    try:
+        while True:
+            resp = google_execute(service.events().instances(
+                calendarId=CALENDAR_ID, eventId=series_id,
+                timeMin=window_start.isoformat() + 'Z', timeMax=window_end.isoformat() + 'Z',
+                maxResults=PAGE_SIZE, pageToken=page_token
+            ))
+            for inst in resp.get('items', []):
+                if inst.get('status') == 'cancelled':
+                    continue
+                db.session.merge(_row(inst, recurring_event_id=series_id))
+                keep.add(inst['id'])
+            page_token = resp.get('nextPageToken')
+            if not page_token:
+                break
+    except HttpError as e:
+        if e.resp.status not in (404, 410):
+            raise
+        print(f"[CalendarSync] Series {series_id} no longer exists")
+
+    stale = [
+        r.id for r in CalendarEvent.query.filter(
+            CalendarEvent.recurring_event_id == series_id,
+            CalendarEvent.start >= window_start,
+            CalendarEvent.start < window_end,
+        )
+        if r.id not in keep
+    ]
+    if stale:
+        CalendarEvent.query.filter(CalendarEvent.id.in_(stale)).delete(synchronize_session=False)
+    db.session.commit()
+
+def sync_calendar(creds: 'Credentials'):
+    """Full pull on first run, syncToken increments afterwards; cheap enough to call every poll.
+
+    Must be called with an app context. Concurrent calls are skipped, not queued.
+    """
+    if not _sync_lock.acquire(blocking=False):
+        return
+    from googleapiclient.errors import HttpError
+    try:
+        service = google_service('calendar', 'v3', creds)
+        state = _state(SYNC_KEY)
+        sync_token = state.cursor
+        try:
+            next_token, series = _pull(service, sync_token)
+        except HttpError as e:
+            if e.resp.status != 410:
+                raise
+            print("[CalendarSync] Sync token expired; running a full sync.")
+            sync_token = None
+            next_token, series = _pull(service, None)
+
+        window_start, window_end = _window()
+        window = _state(WINDOW_KEY)
+        if window.cursor != window_start.isoformat():
+            # The window moved (or this is the first run): re-expand every series
+            series |= {r.id for r in CalendarEvent.query.filter_by(is_series=True)}
+        for series_id in series:
+            _expand_series(service, series_id, window_start, window_end)
+
+        state = _state(SYNC_KEY)
+        state.cursor = next_token
+        state.status = 'complete'
+        window = _state(WINDOW_KEY)
+        window.cursor = window_start.isoformat()
+        db.session.commit()
+        if series or not sync_token:
+            print(f"[CalendarSync] Synced; expanded {len(series)} recurring series.")
+    finally:
+        _sync_lock.release()
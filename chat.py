@@ -0,0 +1,195 @@
+import base64
+import re
+from datetime import datetime, timedelta
+from email.mime.text import MIMEText
+from dateutil.parser import parse as date_parse
+from sqlalchemy import or_
+from models import db, Email, Task
+from ratelimit import estimate_tokens
+
+# The pieces of /chat that don't depend on how it's served; the Flask view in
+# app.py and the async handler in asgi.py both build on these
+
+CHAT_MODEL = "gpt-4-0613"
+USER_TZ = "America/Los_Angeles"
+
+RULES_TEXT = (
+    "You are an AI assistant with access to the user's Gmail and Calendar. "
+    "Answer general queries in natural language using the provided context. "
+    "When asked to send an email or create a calendar event, respond only with the JSON for the corresponding function call. "
+    "Do NOT ask any follow-up questions. "
+    "If scheduling and no date/time is provided, include only 'summary'; server will handle availability and follow-up."
+)
+
+FUNCTIONS = [
+    {
+        "name": "send_email",
+        "description": "Send an email via Gmail API",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "to":      {"type": "string"},
+                "subject": {"type": "string"},
+                "body":    {"type": "string"}
+            },
+            "required": ["to", "subject", "body"]
+        }
+    },
+    {
+        "name": "create_event",
+        "description": "Create a calendar event",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "summary":   {"type": "string"},
+                "start":     {"type": "string"},
+                "end":       {"type": "string"},
+                "attendees": {"type": "array", "items": {"type": "string"}}
+            },
+            "required": ["summary"]
+        }
+    },
+    {
+        "name": "create_instruction",
+        "description": "Save a new ongoing instruction for proactive workflows",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "trigger": {
+                    "type": "string",
+                    "description": "The event to watch for, e.g. 'email_from_unknown' or 'calendar_event_created'"
+                },
+                "action": {
+                    "type": "string",
+                    "description": "The action to take, e.g. 'email_attendees' or 'create_contact_with_note'"
+                },
+                "parameters": {
+                    "type": "object",
+                    "description": "Any extra key/value settings for this instruction"
+                }
+            },
+            "required": ["trigger", "action"]
+        }
+    }
+]
+
+def build_messages(user_msg, docs):
+    context = "\n\n".join(d["content"] for d in docs)
+    return [
+        {"role": "system",  "content": RULES_TEXT},
+        {"role": "system",  "content": f"Context:\n{context}"},
+        {"role": "user",    "content": user_msg}
+    ]
+
+def function_call_for(user_msg):
+    return {"name": "create_event"} if user_msg.lower().startswith("schedule") else "auto"
+
+def completion_tokens(messages):
+    """Token budget to reserve for a completion: the prompt plus room for the reply."""
+    return estimate_tokens([m["content"] for m in messages]) + 1000
+
+def find_contact(name):
+    """Address of the most recent sender whose name or address matches `name`, or None."""
+    contact = (
+        Email.query
+             .filter(or_(
+                 Email.sender_name.ilike(f"%{name}%"),
+                 Email.sender.ilike(f"%{name}%")
+             ))
+             .order_by(Email.date.desc())
+             .first()
+    )
+    return contact.sender if contact else None
+
+def requested_attendees(args):
+    """Attendees from the function call, or the "... with <name>" at the end of the summary."""
+    attendees = args.get("attendees") or []
+    if not attendees:
+        m = re.search(r"[Ww]ith\s+(.+)$", args.get("summary", ""))
+        if m:
+            attendees = [m.group(1).strip()]
+    return attendees
+
+def freebusy_query(now, days):
+    return {
+        "timeMin": now.isoformat() + "Z",
+        "timeMax": (now + timedelta(days=days)).isoformat() + "Z",
+        "items": [{"id": "primary"}]
+    }
+
+def free_slots(busy, now, days=3, hours=(9, 11, 14, 16)):
+    """One-hour slots at `hours` over the next `days` days that don't overlap `busy`."""
+    intervals = [
+        (datetime.fromisoformat(iv["start"].replace("Z", "")),
+         datetime.fromisoformat(iv["end"].replace("Z", "")))
+        for iv in busy
+    ]
+    slots = []
+    for d in range(days):
+        day = now + timedelta(days=d)
+        for h in hours:
+            start_dt = day.replace(hour=h, minute=0, second=0, microsecond=0)
+            end_dt = start_dt + timedelta(hours=1)
+            if all(not (start_dt < be and end_dt > bs) for bs, be in intervals):
+                slots.append(start_dt)
+    return slots
+
+def availability_email(slots):
+    lines = ["Hi,\nHere are my available slots for the next 3 days:"]
+    lines += [f"- {dt.strftime('%A, %B %d at %I:%M %p')}" for dt in slots]
+    lines.append("\nPlease let me know which works for you.\nThanks!")
+    return "\n".join(lines)
+
+def raw_message(to, subject, body):
+    """A Gmail API `raw` payload for a plain-text message."""
+    mime = MIMEText(body)
+    mime["to"]      = to
+    mime["subject"] = subject
+    return base64.urlsafe_b64encode(mime.as_bytes()).decode()
+
+def event_body(summary, start, end, attendees, now=None):
+    now = now or datetime.now()
+    start_dt = date_parse(start, default=now)
+    end_dt   = date_parse(end,   default=now)
+    if start_dt < now:
+        start_dt = start_dt.replace(year=now.year+1)
+    if end_dt < now:
+        end_dt = end_dt.replace(year=now.year+1)
+    return {
+        "summary":   summary,
+        "start":     {"dateTime": start_dt.isoformat(), "timeZone": USER_TZ},
+        "end":       {"dateTime": end_dt.isoformat(),   "timeZone": USER_TZ},
+        "attendees": [{"email": e} for e in attendees]
+    }
+
+def pending_contact():
+    """(task_id, original_args) of the scheduling task waiting for an email address, or None."""
+    task = Task.query.filter_by(status="awaiting_contact").first()
+    return (task.id, task.parameters["original_args"]) if task else None
+
+def await_contact(args):
+    """Park a scheduling request until the user tells us the attendee's address."""
+    task = Task(
+        task_type="schedule_event",
+        parameters={"original_args": args},
+        status="awaiting_contact"
+    )
+    db.session.add(task)
+    db.session.commit()
+    return task.id
+
+def await_slot_reply(args, thread_id, creator_email, slots, task_id=None):
+    """Record that availability went out on `thread_id`; the poller schedules the reply."""
+    task = db.session.get(Task, task_id) if task_id else Task()
+    task.task_type = "schedule_event"
+    # Reassign, don't mutate: in-place changes to a JSON column are not persisted
+    task.parameters = {
+        "original_args": args,
+        "thread_id":     thread_id,
+        "creator_email": creator_email,
+        "offered_slots": [dt.isoformat() for dt in slots]
+    }
+    task.status = "waiting_for_slot"
+    db.session.add(task)
+    db.session.commit()
+    return task.id
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from collections import deque
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+# One pool per process, shared by the ORM, the vector store and background workers
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 5))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# Sized for request traffic; maintenance lifts it per transaction with lift_statement_timeout
+STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 15000))
+# PgBouncer in transaction mode rejects startup options and reassigns server
+# connections between transactions, so the timeout is set per transaction instead
+PGBOUNCER = os.getenv("DB_PGBOUNCER", "0") == "1"
+
+class PoolMetrics:
+    """Time spent waiting for a pooled connection."""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=window)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, waited, timed_out=False):
+        with self._lock:
+            self.checkouts += 1
+            self.timeouts += int(timed_out)
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self._recent.append(waited)
+
+    def snapshot(self):
+        with self._lock:
+            recent = sorted(self._recent)
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": 1000 * self.total_wait / self.checkouts if self.checkouts else 0.0,
+                "p95_wait_ms": 1000 * recent[min(len(recent) - 1, int(0.95 * len(recent)))] if recent else 0.0,
+                "max_wait_ms": 1000 * self.max_wait,
+            }
+
+pool_metrics = PoolMetrics()
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except exc.TimeoutError:
+            pool_metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.record(time.perf_counter() - start)
+        return conn
+
+_engines = {}
+_engines_lock = threading.Lock()
+
+def get_engine(url=None):
+    """Return the process-wide engine for `url` (default: DATABASE_URL), creating it once."""
+    url = make_url(url or os.getenv("DATABASE_URL"))
+    key = url.render_as_string(hide_password=False)
+    with _engines_lock:
+        if key not in _engines:
+            _engines[key] = _create_engine(url)
+        return _engines[key]
+
+def _create_engine(url):
+    connect_args = {"connect_timeout": 10}
+    if not PGBOUNCER:
+        connect_args["options"] = f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"
+
+    engine = create_engine(
+        url,
+        poolclass=TimedQueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=True,
+        # LIFO keeps a small hot set busy and lets surplus connections idle out
+        pool_use_lifo=True,
+        connect_args=connect_args,
+    )
+
+    if PGBOUNCER:
+        @event.listens_for(engine, "begin")
+        def _set_statement_timeout(conn):
+            conn.exec_driver_sql(f"SET LOCAL statement_timeout = {STATEMENT_TIMEOUT_MS}")
+
+    return engine
+
+def lift_statement_timeout(conn):
+    """Run the rest of `conn`'s transaction without the statement timeout.
+
+    For migrations, index builds, partition maintenance and bulk deletes, which
+    legitimately run for minutes. SET LOCAL ends with the transaction, so the
+    connection goes back to the pool with the timeout in place.
+    """
+    conn.exec_driver_sql("SET LOCAL statement_timeout = 0")
+
+def pool_stats(engine=None):
+    engine = engine or get_engine()
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "pgbouncer": PGBOUNCER,
+        **pool_metrics.snapshot(),
+    }
@@ -0,0 +1,157 @@
+from datetime import datetime
+from sqlalchemy import and_, false, or_
+from models import db, AttachmentText, CalendarEvent, Email, EmailAttachment, EmailThread, UNDATED
+from thread_index import naive_utc, strip_quoted, thread_document
+
+# Ingestion and the reindex job both build documents here, so a collection rebuilt
+# from the database holds exactly what live ingestion would have written
+MAX_EMBED_CHARS = 2000
+CHUNK_OVERLAP = 200
+DOC_TYPES = ('email', 'thread', 'event', 'attachment')
+
+def chunk_text(text, size=MAX_EMBED_CHARS, overlap=CHUNK_OVERLAP):
+    """Split `text` into overlapping chunks of at most `size` chars, breaking at newlines where possible."""
+    chunks, start = [], 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            newline = text.rfind('\n', start + size // 2, end)
+            if newline != -1:
+                end = newline
+        chunks.append(text[start:end].strip())
+        if end == len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk]
+
+def iso_date(dt):
+    """A document's date for its metadata: naive UTC in ISO format, or None."""
+    return naive_utc(dt).isoformat() if dt else None
+
+def doc_date(metadata):
+    """The date a document is filed under in the partitioned `embeddings` table."""
+    value = (metadata or {}).get('date')
+    return datetime.fromisoformat(value) if value else UNDATED
+
+def email_document(rec, chunk_chars=MAX_EMBED_CHARS):
+    """(text, metadata) for one message; the text is empty when it adds nothing new to its thread."""
+    # Quoted history is already indexed with the earlier messages of the thread
+    new_content = strip_quoted(rec.body) if rec.body else rec.snippet
+    text = ' '.join(filter(None, [
+        f"From: {rec.sender_name} <{rec.sender}>",
+        rec.subject,
+        new_content
+    ])) if new_content else ''
+    return text[:chunk_chars], {
+        'doc_type': 'email',
+        'doc_id': rec.id,
+        'thread_id': rec.thread_id,
+        'sender_name': rec.sender_name,
+        'sender_email': rec.sender,
+        'date': iso_date(rec.date),
+    }
+
+def event_text(ev, chunk_chars=MAX_EMBED_CHARS):
+    parts = [ev.get('summary'), ev.get('description')]
+    if ev.get('recurrence'):
+        parts.append('Repeats: ' + '; '.join(ev['recurrence']))
+    return ' '.join(filter(None, parts))[:chunk_chars]
+
+def event_metadata(event_id, start):
+    return {'doc_type': 'event', 'doc_id': event_id, 'date': iso_date(start)}
+
+def attachment_documents(email_id, part_id, filename, thread_id, sender_email, text,
+                         chunk_chars=MAX_EMBED_CHARS, date=None):
+    """(doc_id, text, metadata) for each chunk of an attachment's extracted text."""
+    docs = []
+    for n, chunk in enumerate(chunk_text(text or '', size=chunk_chars)):
+        doc_id = f"{email_id}:{part_id}:{n}"
+        docs.append((doc_id, f"Attachment {filename}: {chunk}", {
+            'doc_type': 'attachment',
+            'doc_id': doc_id,
+            'email_id': email_id,
+            'thread_id': thread_id,
+            'filename': filename,
+            'sender_email': sender_email,
+            'date': iso_date(date),
+        }))
+    return docs
+
+def source_key(doc_type, doc_id):
+    """The stored row a document comes from; attachment chunks share their attachment's key."""
+    return doc_id.rsplit(':', 1)[0] if doc_type == 'attachment' else doc_id
+
+def _attachment_query():
+    return (
+        db.session.query(
+            EmailAttachment, AttachmentText.text, Email.thread_id, Email.sender, Email.date
+        )
+        .join(AttachmentText, AttachmentText.sha256 == EmailAttachment.sha256)
+        .outerjoin(Email, Email.id == EmailAttachment.email_id)
+    )
+
+def _rows(doc_type, after=None, keys=None, limit=None):
+    """Rows behind `doc_type` documents in key order, after the `after` key or limited to `keys`."""
+    if doc_type == 'attachment':
+        query = _attachment_query()
+        if keys is not None:
+            pairs = [key.split(':', 1) for key in keys]
+            query = query.filter(or_(*(
+                and_(EmailAttachment.email_id == e, EmailAttachment.part_id == p) for e, p in pairs
+            ))) if pairs else query.filter(false())
+        if after:
+            email_id, part_id = after.split(':', 1)
+            query = query.filter(or_(
+                EmailAttachment.email_id > email_id,
+                and_(EmailAttachment.email_id == email_id, EmailAttachment.part_id > part_id),
+            ))
+        query = query.order_by(EmailAttachment.email_id, EmailAttachment.part_id)
+    else:
+        model = {'email': Email, 'thread': EmailThread, 'event': CalendarEvent}[doc_type]
+        query = model.query
+        if doc_type == 'event':
+            # Instances of a series aren't embedded; the series itself is
+            query = query.filter(CalendarEvent.recurring_event_id.is_(None))
+        if keys is not None:
+            query = query.filter(model.id.in_(keys))
+        if after:
+            query = query.filter(model.id > after)
+        query = query.order_by(model.id)
+    return query.limit(limit).all() if limit else query.all()
+
+def _key(doc_type, row):
+    if doc_type == 'attachment':
+        return f"{row[0].email_id}:{row[0].part_id}"
+    return row.id
+
+def _documents(doc_type, row, chunk_chars):
+    if doc_type == 'email':
+        text, metadata = email_document(row, chunk_chars)
+        return [(row.id, text, metadata)] if text else []
+    if doc_type == 'thread':
+        text, metadata = thread_document(row)
+        return [(row.id, text, metadata)]
+    if doc_type == 'event':
+        text = event_text(row.raw or {}, chunk_chars)
+        return [(row.id, text, event_metadata(row.id, row.start))] if text else []
+    att, text, thread_id, sender, date = row
+    return attachment_documents(
+        att.email_id, att.part_id, att.filename, thread_id, sender, text, chunk_chars, date
+    )
+
+def build_documents(doc_type, keys, chunk_chars=MAX_EMBED_CHARS):
+    """(doc_id, text, metadata) for the stored rows with the given source keys."""
+    return [
+        doc for row in _rows(doc_type, keys=list(keys))
+        for doc in _documents(doc_type, row, chunk_chars)
+    ]
+
+def iter_documents(doc_type, chunk_chars=MAX_EMBED_CHARS, after=None, batch_size=100):
+    """Yield (last_key, documents) batches of every `doc_type` document, resuming after `after`."""
+    while True:
+        rows = _rows(doc_type, after=after, limit=batch_size)
+        if not rows:
+            return
+        after = _key(doc_type, rows[-1])
+        yield after, [doc for row in rows for doc in _documents(doc_type, row, chunk_chars)]
+        db.session.expunge_all()
@@ -0,0 +1,31 @@
+import os
+import threading
+
+_local = threading.local()
+
+def credentials_from_token(tok):
+    """google-auth Credentials for an OAuth token dict as stored by the login callback."""
+    from google.oauth2.credentials import Credentials
+    return Credentials(
+        token=tok["access_token"],
+        refresh_token=tok.get("refresh_token"),
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id=os.getenv("GOOGLE_CLIENT_ID"),
+        client_secret=os.getenv("GOOGLE_CLIENT_SECRET"),
+    )
+
+def google_service(api, version, creds):
+    """Build (once per thread and credentials) a Google API client.
+
+    googleapiclient is imported on first use; discovery documents ship with the
+    library, so building a client needs no network round trip.
+    """
+    cache = getattr(_local, "services", None)
+    if cache is None or cache[0] is not creds:
+        cache = (creds, {})
+        _local.services = cache
+    services = cache[1]
+    if (api, version) not in services:
+        from googleapiclient.discovery import build
+        services[(api, version)] = build(api, version, credentials=creds, cache_discovery=False)
+    return services[(api, version)]
@@ -1,179 +1,409 @@
-import os
-import json
 import base64
 import email
-import time
-import openai
-from datetime import datetime
-from http.client import RemoteDisconnected
-from urllib3.exceptions import ProtocolError
-from googleapiclient.discovery import build
-from google.oauth2.credentials import Credentials
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
 from dateutil import parser as date_parser
-from models import db, Email, CalendarEvent, Embedding
-from vectorstore import vectordb  
-from langchain.schema import Document
+from attachments import (
+    EXTRACT_TIMEOUT, MAX_ATTACHMENT_BYTES, batches, html_to_text, is_supported, mime_type_of,
+    result as extraction_result, submit, walk_parts
+)
+from documents import (
+    attachment_documents, build_documents, doc_date, email_document, source_key
+)
+from google_clients import google_service
+from models import (
+    db, AttachmentText, EMBEDDING_DIM, Email, EmailAttachment, Embedding, UNDATED
+)
+from thread_index import apply_to_threads, naive_utc
+from vectorstore import active_version, delete_documents, live_versions, upsert_embeddings
+from ratelimit import (
+    MAX_CONCURRENCY, authorized_http, estimate_tokens,
+    google_execute, openai_call
+)
 
-MAX_EMBED_CHARS = 2000
-RETRY_LIMIT = 3
-RETRY_DELAY = 2  
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials
+
+EMBED_BATCH = 100
+
+def _decode(data):
+    return base64.urlsafe_b64decode(data.encode('utf-8')).decode('utf-8', errors='replace')
 
 def extract_body(payload):
-    parts = payload.get('parts') or []
-    for part in parts:
-        if part.get('mimeType') == 'text/plain' and part.get('body', {}).get('data'):
-            data = part['body']['data']
-            return base64.urlsafe_b64decode(data.encode('utf-8')).decode('utf-8')
-    data = payload.get('body', {}).get('data')
-    if data:
-        return base64.urlsafe_b64decode(data.encode('utf-8')).decode('utf-8')
-    return ''
-
-def safe_execute(func, *args, **kwargs):
-    for attempt in range(RETRY_LIMIT):
-        try:
-            return func(*args, **kwargs)
-        except (ProtocolError, RemoteDisconnected) as e:
-            print(f"Network error on attempt {attempt+1}: {e}")
-            time.sleep(RETRY_DELAY)
-    raise
-
-def ingest_gmail(creds: Credentials, max_results: int = 50):
-    service = build('gmail', 'v1', credentials=creds)
-    try:
-        results = safe_execute(
-            service.users().messages().list,
-            userId='me', maxResults=max_results
-        ).execute()
-    except Exception as e:
-        print(f"Failed to list Gmail messages: {e}")
+    """Body text of a message: the first text/plain part anywhere in the tree, else its HTML as text."""
+    plain = html = None
+    for part in walk_parts(payload):
+        data = part.get('body', {}).get('data')
+        if not data or part.get('filename'):
+            continue
+        mime_type = part.get('mimeType', '')
+        if mime_type == 'text/plain' and plain is None:
+            plain = _decode(data)
+        elif mime_type == 'text/html' and html is None:
+            html = _decode(data)
+    if plain:
+        return plain
+    return html_to_text(html) if html else ''
+
+def embed_texts(texts, config=None):
+    """Embed `texts` with the model of index version `config` (default: the active one)."""
+    import openai
+    config = config or active_version()
+    options = {'dimensions': config.dimensions} if config.dimensions else {}
+    texts = list(texts)
+    vectors = []
+    for i in range(0, len(texts), EMBED_BATCH):
+        batch = texts[i:i + EMBED_BATCH]
+        emb_resp = openai_call(
+            openai.Embedding.create, estimate_tokens(batch),
+            input=batch, model=config.model, **options
+        )
+        vectors.extend(d['embedding'] for d in sorted(emb_resp['data'], key=lambda d: d['index']))
+    return vectors
+
+def embed_text(text):
+    return embed_texts([text])[0]
+
+def message_date(msg):
+    """When Gmail received `msg`, as naive UTC; falls back to the Date header."""
+    if msg.get('internalDate'):
+        return datetime.fromtimestamp(int(msg['internalDate']) / 1000, timezone.utc).replace(tzinfo=None)
+    headers = msg.get('payload', {}).get('headers', [])
+    date_str = next((h['value'] for h in headers if h['name'] == 'Date'), None)
+    if not date_str:
+        return None
+    date_obj = date_parser.parse(date_str)
+    return naive_utc(date_obj)
+
+def _write_embeddings(doc_type, items, config):
+    doc_ids = [doc_id for doc_id, _, _, _ in items]
+    Embedding.query.filter(
+        Embedding.collection == config.collection,
+        Embedding.doc_type == doc_type, Embedding.doc_id.in_(doc_ids)
+    ).delete(synchronize_session=False)
+    # The compact ANN indexes only cover EMBEDDING_DIM; other sizes live in PGVector alone
+    db.session.add_all(
+        Embedding(collection=config.collection, doc_type=doc_type, doc_id=doc_id, vector=vector,
+                  doc_date=doc_date(metadata))
+        for doc_id, _, vector, metadata in items
+        if len(vector) == EMBEDDING_DIM
+    )
+    db.session.commit()
+
+    # PGVector keeps the text and metadata search joins back to; the vectors
+    # `embeddings` already holds aren't stored a second time
+    upsert_embeddings(
+        texts=[text for _, text, _, _ in items],
+        vectors=[None if len(vector) == EMBEDDING_DIM else vector for _, _, vector, _ in items],
+        metadatas=[meta for _, _, _, meta in items],
+        ids=[f"{doc_type}:{doc_id}" for doc_id in doc_ids],
+        config=config,
+    )
+
+def store_embeddings(doc_type, items, config=None):
+    """Replace the embeddings for `items` ((doc_id, text, vector, metadata) tuples) in both stores.
+
+    Without `config` the items go to the active version, and the same documents
+    are rebuilt from the database for any version still being built, so a
+    reindex doesn't miss what arrives while it runs.
+    """
+    if config is not None:
+        _write_embeddings(doc_type, items, config)
         return
+    active, building = live_versions()
+    _write_embeddings(doc_type, items, active)
+    keys = {source_key(doc_type, doc_id) for doc_id, _, _, _ in items}
+    for config in building:
+        try:
+            docs = build_documents(doc_type, keys, config.chunk_chars)
+            if docs:
+                vectors = embed_texts([text for _, text, _ in docs], config)
+                _write_embeddings(doc_type, [
+                    (doc_id, text, vector, metadata)
+                    for (doc_id, text, metadata), vector in zip(docs, vectors)
+                ], config)
+        except Exception as e:
+            print(f"Couldn't mirror {len(keys)} {doc_type} documents into {config.collection}: {e}")
 
-    messages = results.get('messages', [])
-    for m in messages:
+def fetch_concurrently(creds, requests):
+    """Execute independent Google requests in parallel; the rate limiter decides how many are in flight."""
+    def run(req):
         try:
-            msg = safe_execute(
-                service.users().messages().get,
-                userId='me', id=m['id'], format='full'
-            ).execute()
+            return google_execute(req, http=authorized_http(creds))
         except Exception as e:
-            print(f"Skipping message {m['id']} due to fetch error: {e}")
-            continue
+            print(f"Request {req.methodId} failed: {e}")
+            return None
 
-        snippet = msg.get('snippet', '')
-        payload = msg.get('payload', {})
-        headers = payload.get('headers', [])
-        subject = next((h['value'] for h in headers if h['name'] == 'Subject'), None)
-        from_hdr = next((h['value'] for h in headers if h['name'] == 'From'), '')
-        # Parse name and email address
-        name, addr = email.utils.parseaddr(from_hdr)
-        date_str = next((h['value'] for h in headers if h['name'] == 'Date'), None)
-        date_obj = date_parser.parse(date_str) if date_str else None
-        body = extract_body(payload)
-
-        email_rec = Email(
-            id=msg['id'],
-            thread_id=msg.get('threadId'),
-            sender=addr,
-            sender_name=name,
-            subject=subject,
-            date=date_obj,
-            snippet=snippet,
-            body=body,
-            raw=msg
-        )
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as pool:
+        return list(pool.map(run, requests))
+
+def delete_embeddings(doc_type, doc_ids):
+    """Delete documents from the active version and any version being built."""
+    active, building = live_versions()
+    Embedding.query.filter(
+        Embedding.collection.in_([active.collection] + [c.collection for c in building]),
+        Embedding.doc_type == doc_type, Embedding.doc_id.in_(doc_ids)
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    for config in [active] + building:
+        delete_documents([f"{doc_type}:{doc_id}" for doc_id in doc_ids], config)
+
+def parse_message(msg):
+    """Build the Email row, text to embed and vector metadata for a full-format Gmail message."""
+    snippet = msg.get('snippet', '')
+    payload = msg.get('payload', {})
+    headers = payload.get('headers', [])
+    subject = next((h['value'] for h in headers if h['name'] == 'Subject'), None)
+    from_hdr = next((h['value'] for h in headers if h['name'] == 'From'), '')
+    # Parse name and email address
+    name, addr = email.utils.parseaddr(from_hdr)
+    body = extract_body(payload)
+
+    email_rec = Email(
+        id=msg['id'],
+        thread_id=msg.get('threadId'),
+        sender=addr,
+        sender_name=name,
+        subject=subject,
+        date=message_date(msg) or UNDATED,
+        snippet=snippet,
+        body=body,
+        raw=msg
+    )
+    text, metadata = email_document(email_rec, active_version().chunk_chars)
+    return email_rec, text, metadata
+
+def embed_parsed(parsed):
+    """Embed messages that have new content; vectors line up with `parsed`, None where skipped."""
+    todo = [i for i, (_, text, _) in enumerate(parsed) if text]
+    vectors = [None] * len(parsed)
+    if todo:
+        for i, vector in zip(todo, embed_texts([parsed[i][1] for i in todo])):
+            vectors[i] = vector
+    return vectors
+
+def _reindex_threads(email_recs):
+    changed = apply_to_threads(email_recs)
+    if not changed:
+        return
+    try:
+        vectors = embed_texts([text for _, text, _ in changed])
+        # Commits the thread rows together with their embeddings
+        store_embeddings('thread', [
+            (thread_id, text, vector, metadata)
+            for (thread_id, text, metadata), vector in zip(changed, vectors)
+        ])
+    except Exception as e:
+        # Leave the threads as they were, so these messages are folded in next time
+        db.session.rollback()
+        print(f"Embedding skipped for {len(changed)} threads: {e}")
+
+def write_messages(parsed, vectors):
+    """Upsert a batch of parsed messages and their embeddings (None if embedding failed)."""
+    for email_rec, _, _ in parsed:
         db.session.merge(email_rec)
-        db.session.commit()
-
-        full_text = ' '.join(filter(None, [
-            f"From: {name} <{addr}>",
-            subject,
-            snippet,
-            body
-        ]))
-        text_to_embed = full_text[:MAX_EMBED_CHARS]
-        try:
-            emb_resp = openai.Embedding.create(
-                input=text_to_embed,
-                model='text-embedding-ada-002'
-            )
-            vector = emb_resp['data'][0]['embedding']
+    db.session.commit()
 
-            # Upsert Embedding model
-            embedding = Embedding(
-                doc_type='email', doc_id=msg['id'], vector=vector
-            )
-            db.session.merge(embedding)
-            db.session.commit()
-
-            # Upsert into LangChain vectorstore
-            doc = Document(
-                page_content=text_to_embed,
-                metadata={
-                    'doc_type': 'email',
-                    'doc_id': msg['id'],
-                    'sender_name': name,
-                    'sender_email': addr
-                }
+    if vectors is not None:
+        items = [
+            (email_rec.id, text, vector, metadata)
+            for (email_rec, text, metadata), vector in zip(parsed, vectors)
+            if vector is not None
+        ]
+        if items:
+            store_embeddings('email', items)
+        _reindex_threads([email_rec for email_rec, _, _ in parsed])
+    db.session.expunge_all()
+
+def collect_attachments(creds: 'Credentials', msgs):
+    """Fetch the not-yet-indexed attachments of `msgs` and start extracting their text.
+
+    Returns one dict per attachment. Cache hits come back with `text` set; the
+    rest carry a `future` from the extraction pool, resolved in embed_attachments.
+    Needs an app context for the cache lookups.
+    """
+    wanted = []
+    for msg in msgs:
+        for part in walk_parts(msg.get('payload', {})):
+            body = part.get('body', {})
+            mime_type = mime_type_of(part.get('mimeType'), part.get('filename'))
+            if (body.get('attachmentId') and part.get('filename') and is_supported(mime_type)
+                    and body.get('size', 0) <= MAX_ATTACHMENT_BYTES):
+                wanted.append((msg, part, mime_type))
+    if not wanted:
+        return []
+
+    indexed = {
+        (row.email_id, row.part_id) for row in EmailAttachment.query.filter(
+            EmailAttachment.email_id.in_({msg['id'] for msg, _, _ in wanted})
+        )
+    }
+    wanted = [(msg, part, mime_type) for msg, part, mime_type in wanted
+              if (msg['id'], part.get('partId')) not in indexed]
+    if not wanted:
+        return []
+
+    service = google_service('gmail', 'v1', creds)
+    items = []
+    # Fetch in slices of at most MAX_INFLIGHT_BYTES; `submit` blocks once that much
+    # is queued for extraction, so a page of large files is never all in memory
+    for batch in batches(wanted, lambda w: w[1]['body'].get('size', 0)):
+        items.extend(_start_extraction(batch, fetch_concurrently(creds, [
+            service.users().messages().attachments().get(
+                userId='me', messageId=msg['id'], id=part['body']['attachmentId']
             )
-            vectordb.add_documents([doc])
-        except Exception as e:
-            print(f"Embedding skipped for email {msg['id']}: {e}")
+            for msg, part, _ in batch
+        ])))
+    return items
+
+def _start_extraction(batch, fetched):
+    """Decode one fetched batch, look it up in the text cache and submit the misses."""
+    items = []
+    for (msg, part, mime_type), body in zip(batch, fetched):
+        if not body or not body.get('data'):
             continue
+        data = base64.urlsafe_b64decode(body['data'].encode('utf-8'))
+        headers = msg.get('payload', {}).get('headers', [])
+        from_hdr = next((h['value'] for h in headers if h['name'] == 'From'), '')
+        items.append({
+            'email_id': msg['id'],
+            'thread_id': msg.get('threadId'),
+            'part_id': part.get('partId'),
+            'filename': part['filename'],
+            'mime_type': mime_type,
+            'sender_email': email.utils.parseaddr(from_hdr)[1],
+            'date': message_date(msg),
+            'size': len(data),
+            'sha256': hashlib.sha256(data).hexdigest(),
+            'data': data,
+        })
+    # Only the decoded bytes are needed from here on
+    fetched = body = None
 
-    print(f"Ingested {len(messages)} emails.")
+    cached = {
+        row.sha256: row.text for row in AttachmentText.query.filter(
+            AttachmentText.sha256.in_({item['sha256'] for item in items})
+        )
+    }
+    futures = {}
+    for item in items:
+        data = item.pop('data')
+        if item['sha256'] in cached:
+            item['text'] = cached[item['sha256']]
+            continue
+        # The same file attached to several messages is extracted once
+        if item['sha256'] not in futures:
+            futures[item['sha256']] = submit(item['mime_type'], data)
+        item['future'] = futures[item['sha256']]
+    return items
+
+def embed_attachments(items):
+    """Wait for extraction, then chunk and embed the text; sets `docs` and `vectors` on each item."""
+    chunk_chars = active_version().chunk_chars
+    outcomes = {}
+    for item in items:
+        future = item.pop('future', None)
+        if future is not None:
+            # Duplicates share one future; wait on it (and time it out) only once
+            if future not in outcomes:
+                try:
+                    outcomes[future] = (extraction_result(future), True)
+                except TimeoutError:
+                    # Cached as failed (no text), so the file isn't parsed again
+                    print(f"Gave up extracting text from {item['filename']} after {EXTRACT_TIMEOUT:.0f}s")
+                    outcomes[future] = (None, True)
+                except Exception as e:
+                    print(f"Couldn't extract text from {item['filename']}: {e}")
+                    outcomes[future] = (None, False)
+            item['text'], extracted = outcomes[future]
+            if extracted:
+                item['extracted'] = True
+        item['docs'] = attachment_documents(
+            item['email_id'], item['part_id'], item['filename'], item['thread_id'],
+            item['sender_email'], item['text'], chunk_chars, item['date']
+        )
+        item['vectors'] = None
 
-def ingest_calendar(creds: Credentials, max_results: int = 10):
-    from datetime import datetime
-    service = build('calendar', 'v3', credentials=creds)
+    todo = [item for item in items if item['docs']]
+    texts = [text for item in todo for _, text, _ in item['docs']]
+    if not texts:
+        return
     try:
-        now_iso = datetime.utcnow().isoformat() + 'Z'
-        events_result = safe_execute(
-            service.events().list,
-            calendarId='primary', timeMin=now_iso,
-            maxResults=max_results, singleEvents=True,
-            orderBy='startTime'
-        ).execute()
+        vectors = iter(embed_texts(texts))
     except Exception as e:
-        print(f"Failed to list Calendar events: {e}")
+        print(f"Embedding skipped for {len(todo)} attachments: {e}")
         return
+    for item in todo:
+        item['vectors'] = [next(vectors) for _ in item['docs']]
+
+def write_attachments(items):
+    """Cache newly extracted text by hash and store the chunk embeddings of each attachment.
 
-    events = events_result.get('items', [])
-    for ev in events:
-        start_raw = ev.get('start', {}).get('dateTime') or ev.get('start', {}).get('date')
-        end_raw = ev.get('end', {}).get('dateTime') or ev.get('end', {}).get('date')
-        start_dt = date_parser.parse(start_raw) if start_raw else None
-        end_dt = date_parser.parse(end_raw) if end_raw else None
-        attendees = [a.get('email') for a in ev.get('attendees', [])]
-
-        # Upsert CalendarEvent record
-        event_rec = CalendarEvent(
-            id=ev['id'], summary=ev.get('summary'), start=start_dt, end=end_dt
+    An attachment is only recorded as indexed once its chunks are stored, so one
+    whose extraction or embedding failed is picked up again on the next ingest.
+    """
+    indexed, embedded = [], []
+    for item in items:
+        if item.get('extracted'):
+            db.session.merge(AttachmentText(
+                sha256=item['sha256'], mime_type=item['mime_type'], text=item['text']
+            ))
+        if item['text'] is None or (item['docs'] and item['vectors'] is None):
+            continue
+        indexed.append(item)
+        db.session.merge(EmailAttachment(
+            email_id=item['email_id'],
+            part_id=item['part_id'],
+            filename=item['filename'],
+            mime_type=item['mime_type'],
+            size=item['size'],
+            sha256=item['sha256'],
+        ))
+        embedded.extend(
+            (doc_id, text, vector, metadata)
+            for (doc_id, text, metadata), vector in zip(item['docs'], item['vectors'] or [])
         )
-        event_rec.attendees = json.dumps(attendees)
-        db.session.merge(event_rec)
-        db.session.commit()
+    db.session.commit()
+    if embedded:
+        store_embeddings('attachment', embedded)
+    db.session.expunge_all()
+    if indexed:
+        print(f"Indexed {len(indexed)} attachments ({len(embedded)} chunks).")
 
-        # Prepare text for embedding
-        title_desc = ' '.join(filter(None, [ev.get('summary'), ev.get('description')]))
-        text_to_embed = title_desc[:MAX_EMBED_CHARS]
-        try:
-            emb_resp = openai.Embedding.create(
-                input=text_to_embed, model='text-embedding-ada-002'
-            )
-            vector = emb_resp['data'][0]['embedding']
-            embedding = Embedding(
-                doc_type='event', doc_id=ev['id'], vector=vector
-            )
-            db.session.merge(embedding)
-            db.session.commit()
+def ingest_gmail(creds: 'Credentials', max_results: int = 50):
+    service = google_service('gmail', 'v1', creds)
+    try:
+        results = google_execute(
+            service.users().messages().list(userId='me', maxResults=max_results)
+        )
+    except Exception as e:
+        print(f"Failed to list Gmail messages: {e}")
+        return
 
-            doc = Document(
-                page_content=text_to_embed,
-                metadata={'doc_type': 'event', 'doc_id': ev['id']}
-            )
-            vectordb.add_documents([doc])
-        except Exception as e:
-            print(f"Embedding skipped for event {ev['id']}: {e}")
+    messages = results.get('messages', [])
+    fetched = fetch_concurrently(creds, [
+        service.users().messages().get(userId='me', id=m['id'], format='full')
+        for m in messages
+    ])
+    parsed = []
+    for m, msg in zip(messages, fetched):
+        if msg is None:
+            print(f"Skipping message {m['id']} due to fetch error")
+            continue
+        parsed.append(parse_message(msg))
+    # Extraction runs in the worker pool while the bodies are embedded and written
+    attachments = collect_attachments(creds, [msg for msg in fetched if msg is not None])
+
+    try:
+        vectors = embed_parsed(parsed)
+    except Exception as e:
+        print(f"Embedding skipped for {len(parsed)} emails: {e}")
+        vectors = None
+    write_messages(parsed, vectors)
 
-    print(f"Ingested {len(events)} calendar events.")
\ No newline at end of file
+    embed_attachments(attachments)
+    write_attachments(attachments)
+
+    print(f"Ingested {len(messages)} emails.")
@@ -0,0 +1,110 @@
+"""Load-test /chat and compare the sync (gunicorn) and async (uvicorn asgi:app) servers.
+
+    python loadtest_chat.py stub --latency 0.8 --port 9000
+    python loadtest_chat.py run --url http://localhost:8000 \
+        --compare http://localhost:8001 --concurrency 50 --requests 500
+
+`run` sends `--requests` chat messages, `--concurrency` at a time, to each URL
+and reports throughput, p50/p95 latency and errors. `stub` serves fake OpenAI
+embeddings and completions after a fixed delay. Start both servers with
+OPENAI_API_BASE=http://localhost:9000 so the comparison measures how many
+conversations a worker can hold open, not OpenAI's latency or your quota.
+Pass `--cookie` (the Flask `session` cookie) when the messages need Google.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+async def _run(url, concurrency, total, message, cookie):
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for _ in range(total):
+        queue.put_nowait(None)
+
+    async def worker(client):
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            t = time.perf_counter()
+            try:
+                resp = await client.post("/chat", json={"message": message})
+                resp.raise_for_status()
+                latencies.append(time.perf_counter() - t)
+            except httpx.HTTPError:
+                errors += 1
+
+    cookies = {"session": cookie} if cookie else None
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, cookies=cookies, limits=limits, timeout=120) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+def _report(url, latencies, errors, elapsed):
+    print(f"{url}")
+    print(f"  {len(latencies)} ok, {errors} errors in {elapsed:.1f}s "
+          f"-> {len(latencies) / elapsed:.1f} req/s")
+    if latencies:
+        latencies.sort()
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"  p50 {statistics.median(latencies) * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms")
+
+def run(args):
+    for url in filter(None, [args.url, args.compare]):
+        _report(url, *asyncio.run(
+            _run(url, args.concurrency, args.requests, args.message, args.cookie)
+        ))
+
+def stub(args):
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse
+    from starlette.routing import Route
+
+    async def embeddings(request):
+        payload = await request.json()
+        await asyncio.sleep(args.latency / 4)
+        texts = payload["input"] if isinstance(payload["input"], list) else [payload["input"]]
+        dims = payload.get("dimensions", 1536)
+        return JSONResponse({"data": [
+            {"index": i, "embedding": [0.0] * (dims - 1) + [1.0]} for i in range(len(texts))
+        ]})
+
+    async def completions(request):
+        await asyncio.sleep(args.latency)
+        return JSONResponse({"choices": [{
+            "message": {"role": "assistant", "content": "Stub reply."}, "finish_reason": "stop"
+        }]})
+
+    uvicorn.run(Starlette(routes=[
+        Route("/embeddings", embeddings, methods=["POST"]),
+        Route("/chat/completions", completions, methods=["POST"]),
+    ]), host="127.0.0.1", port=args.port, log_level="warning")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="send chat traffic and report throughput")
+    p.add_argument("--url", required=True)
+    p.add_argument("--compare", help="second server to run the same load against")
+    p.add_argument("--concurrency", type=int, default=20)
+    p.add_argument("--requests", type=int, default=200)
+    p.add_argument("--message", default="What did I discuss with Alice last week?")
+    p.add_argument("--cookie", help="Flask session cookie value")
+    p.set_defaults(func=run)
+
+    p = sub.add_parser("stub", help="serve fake OpenAI responses after a delay")
+    p.add_argument("--latency", type=float, default=0.8, help="seconds per completion")
+    p.add_argument("--port", type=int, default=9000)
+    p.set_defaults(func=stub)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
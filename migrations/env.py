@@ -104,6 +104,9 @@ def run_migrations_online():
         )
 
         with context.begin_transaction():
+            # Rewriting tables and building HNSW indexes outlasts the request timeout
+            from database import lift_statement_timeout
+            lift_statement_timeout(connection)
             context.run_migrations()
 
 
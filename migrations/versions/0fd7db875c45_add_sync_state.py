@@ -0,0 +1,31 @@
+"""Add sync_state for resumable ingestion checkpoints
+
+Revision ID: 0fd7db875c45
+Revises: 5346b510c4f6
+Create Date: 2026-10-19 09:12:41.508311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0fd7db875c45'
+down_revision = '5346b510c4f6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sync_state',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('cursor', sa.String(), nullable=True),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('processed', sa.Integer(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('sync_state')
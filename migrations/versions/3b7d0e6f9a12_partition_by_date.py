@@ -0,0 +1,140 @@
+"""Partition emails and embeddings by month
+
+Revision ID: 3b7d0e6f9a12
+Revises: e2f58b1c9d47
+Create Date: 2026-10-19 18:02:44.108326
+
+"""
+import os
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b7d0e6f9a12'
+down_revision = 'e2f58b1c9d47'
+branch_labels = None
+depends_on = None
+
+MONTHS_AHEAD = 3
+# Only the ANN index VECTOR_SEARCH_MODE searches is rebuilt; `flask index ann` switches later
+ANN_INDEXES = {
+    'halfvec': "CREATE INDEX ix_embeddings_vector_halfvec ON embeddings "
+               "USING hnsw ((vector::halfvec(1536)) halfvec_cosine_ops)",
+    'binary': "CREATE INDEX ix_embeddings_vector_binary ON embeddings "
+              "USING hnsw ((binary_quantize(vector)::bit(1536)) bit_hamming_ops)",
+}
+
+
+def _add_months(month, n):
+    y, m = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return datetime(y, m + 1, 1)
+
+
+def _attach(table, name, bound):
+    # LIKE ... INCLUDING STORAGE keeps the vectors stored out of line in every partition
+    op.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING STORAGE)")
+    op.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} {bound}")
+
+
+def _partition(table, column):
+    """Create the default and monthly partitions of `table`, then copy its old rows in."""
+    old = f"{table}_unpartitioned"
+    lo = op.get_bind().execute(sa.text(
+        f"SELECT min({column}) FROM {old} WHERE {column} > '1970-01-01'"
+    )).scalar()
+    now = datetime.utcnow()
+    month = datetime((lo or now).year, (lo or now).month, 1)
+    last = _add_months(datetime(now.year, now.month, 1), MONTHS_AHEAD)
+    _attach(table, f"{table}_default", "DEFAULT")
+    while month <= last:
+        _attach(table, f"{table}_p{month:%Y_%m}",
+                f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_add_months(month, 1):%Y-%m-%d}')")
+        month = _add_months(month, 1)
+    op.execute(f"INSERT INTO {table} SELECT * FROM {old}")
+    op.execute(f"DROP TABLE {old}")
+
+
+def upgrade():
+    # Postgres can't partition a table in place: rename, recreate, copy
+    op.execute("ALTER TABLE emails DROP CONSTRAINT emails_pkey")
+    op.execute("ALTER TABLE emails RENAME TO emails_unpartitioned")
+    # Gmail's internalDate is the partition key from now on
+    op.execute(
+        "UPDATE emails_unpartitioned "
+        "SET date = timestamp 'epoch' + (raw->>'internalDate')::bigint * interval '1 millisecond' "
+        "WHERE raw->>'internalDate' IS NOT NULL"
+    )
+    op.execute("UPDATE emails_unpartitioned SET date = '1970-01-01' WHERE date IS NULL")
+    op.execute(
+        "CREATE TABLE emails (LIKE emails_unpartitioned INCLUDING DEFAULTS INCLUDING STORAGE, "
+        "PRIMARY KEY (id, date)) PARTITION BY RANGE (date)"
+    )
+    _partition('emails', 'date')
+
+    op.execute("DROP INDEX IF EXISTS ix_embeddings_vector_halfvec")
+    op.execute("DROP INDEX IF EXISTS ix_embeddings_vector_binary")
+    op.execute("DROP INDEX IF EXISTS ix_embeddings_collection_doc")
+    op.execute("ALTER TABLE embeddings DROP CONSTRAINT embeddings_pkey")
+    op.execute("ALTER TABLE embeddings RENAME TO embeddings_unpartitioned")
+    op.execute(
+        "ALTER TABLE embeddings_unpartitioned "
+        "ADD COLUMN doc_date TIMESTAMP WITHOUT TIME ZONE NOT NULL DEFAULT '1970-01-01'"
+    )
+    # Date every document like ingestion does: messages and their attachments by
+    # internalDate, threads by their last message, events by their start
+    op.execute(
+        "UPDATE embeddings_unpartitioned e SET doc_date = m.date FROM emails m "
+        "WHERE e.doc_type = 'email' AND m.id = e.doc_id"
+    )
+    op.execute(
+        "UPDATE embeddings_unpartitioned e SET doc_date = m.date FROM emails m "
+        "WHERE e.doc_type = 'attachment' AND m.id = split_part(e.doc_id, ':', 1)"
+    )
+    op.execute(
+        "UPDATE embeddings_unpartitioned e SET doc_date = t.last_date FROM email_threads t "
+        "WHERE e.doc_type = 'thread' AND t.id = e.doc_id AND t.last_date IS NOT NULL"
+    )
+    op.execute(
+        "UPDATE embeddings_unpartitioned e SET doc_date = ev.start FROM events ev "
+        "WHERE e.doc_type = 'event' AND ev.id = e.doc_id AND ev.start IS NOT NULL"
+    )
+    op.execute(
+        "CREATE TABLE embeddings (LIKE embeddings_unpartitioned INCLUDING DEFAULTS INCLUDING STORAGE, "
+        "PRIMARY KEY (id, doc_date)) PARTITION BY RANGE (doc_date)"
+    )
+    # The id sequence belongs to the old table; hand it over before that is dropped
+    op.execute("ALTER SEQUENCE embeddings_id_seq OWNED BY embeddings.id")
+    _partition('embeddings', 'doc_date')
+
+    # Indexes on the parent are built on every partition, each with its own HNSW graph
+    op.execute("CREATE INDEX ix_embeddings_collection_doc ON embeddings (collection, doc_type, doc_id)")
+    _ann_index()
+
+
+def _ann_index():
+    mode = os.getenv("VECTOR_SEARCH_MODE", "float32")
+    if mode in ANN_INDEXES:
+        op.execute(ANN_INDEXES[mode])
+
+
+def downgrade():
+    op.execute("ALTER TABLE embeddings RENAME TO embeddings_partitioned")
+    op.execute(
+        "CREATE TABLE embeddings (LIKE embeddings_partitioned INCLUDING DEFAULTS INCLUDING STORAGE)"
+    )
+    op.execute("ALTER SEQUENCE embeddings_id_seq OWNED BY embeddings.id")
+    op.execute("INSERT INTO embeddings SELECT * FROM embeddings_partitioned")
+    op.execute("DROP TABLE embeddings_partitioned")
+    op.execute("ALTER TABLE embeddings DROP COLUMN doc_date")
+    op.execute("ALTER TABLE embeddings ADD PRIMARY KEY (id)")
+    op.execute("CREATE INDEX ix_embeddings_collection_doc ON embeddings (collection, doc_type, doc_id)")
+    _ann_index()
+
+    op.execute("ALTER TABLE emails RENAME TO emails_partitioned")
+    op.execute("CREATE TABLE emails (LIKE emails_partitioned INCLUDING DEFAULTS INCLUDING STORAGE)")
+    op.execute("INSERT INTO emails SELECT * FROM emails_partitioned")
+    op.execute("DROP TABLE emails_partitioned")
+    op.execute("ALTER TABLE emails ADD PRIMARY KEY (id)")
+    op.execute("ALTER TABLE emails ALTER COLUMN date DROP NOT NULL")
@@ -0,0 +1,32 @@
+"""Add email_threads for thread-level indexing
+
+Revision ID: 605288da50e3
+Revises: b83066e90829
+Create Date: 2026-10-19 13:26:52.871420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '605288da50e3'
+down_revision = 'b83066e90829'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('email_threads',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('subject', sa.String(), nullable=True),
+    sa.Column('participants', sa.JSON(), nullable=True),
+    sa.Column('segments', sa.JSON(), nullable=True),
+    sa.Column('last_date', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('email_threads')
@@ -0,0 +1,41 @@
+"""Compact ANN indexes on embeddings for quantized search
+
+Revision ID: 7a9c3f1d5e20
+Revises: c41d7e9a02b6
+Create Date: 2026-10-19 15:48:37.215904
+
+"""
+import os
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7a9c3f1d5e20'
+down_revision = 'c41d7e9a02b6'
+branch_labels = None
+depends_on = None
+
+# Only the index VECTOR_SEARCH_MODE searches is built; `flask index ann` switches later
+ANN_INDEXES = {
+    'halfvec': "CREATE INDEX ix_embeddings_vector_halfvec ON embeddings "
+               "USING hnsw ((vector::halfvec(1536)) halfvec_cosine_ops)",
+    'binary': "CREATE INDEX ix_embeddings_vector_binary ON embeddings "
+              "USING hnsw ((binary_quantize(vector)::bit(1536)) bit_hamming_ops)",
+}
+
+
+def upgrade():
+    # halfvec and binary_quantize need pgvector >= 0.7
+    op.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    # The ANN search only touches the index; full vectors are read for the few
+    # candidates being reranked, so keep them out of line and uncompressed
+    op.execute("ALTER TABLE embeddings ALTER COLUMN vector SET STORAGE EXTERNAL")
+    mode = os.getenv("VECTOR_SEARCH_MODE", "float32")
+    if mode in ANN_INDEXES:
+        op.execute(ANN_INDEXES[mode])
+
+
+def downgrade():
+    op.execute("DROP INDEX IF EXISTS ix_embeddings_vector_binary")
+    op.execute("DROP INDEX IF EXISTS ix_embeddings_vector_halfvec")
+    op.execute("ALTER TABLE embeddings ALTER COLUMN vector SET STORAGE EXTENDED")
@@ -0,0 +1,64 @@
+"""Re-key legacy vector-store rows as "<doc_type>:<doc_id>"
+
+Revision ID: a4c82e17d3f5
+Revises: 0fd7db875c45
+Create Date: 2026-10-19 09:40:17.226093
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4c82e17d3f5'
+down_revision = '0fd7db875c45'
+branch_labels = None
+depends_on = None
+
+# Rows written before documents had stable ids carry a random UUID custom_id
+LEGACY = "(d.custom_id IS NULL OR d.custom_id NOT LIKE '%:%')"
+NEW_ID = "(d.cmetadata->>'doc_type') || ':' || (d.cmetadata->>'doc_id')"
+
+
+def upgrade():
+    # langchain creates its table on first use, so a fresh database has none yet
+    if op.get_bind().execute(sa.text("SELECT to_regclass('langchain_pg_embedding')")).scalar() is not None:
+        _rekey_store()
+    # `embeddings` collected the same duplicates through merge() without a key
+    op.execute(
+        "DELETE FROM embeddings e USING embeddings k "
+        "WHERE k.doc_type = e.doc_type AND k.doc_id = e.doc_id AND e.id < k.id"
+    )
+
+
+def _rekey_store():
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_custom_id "
+        "ON langchain_pg_embedding (custom_id)"
+    )
+    # Without a doc_type/doc_id in the metadata a row can never be updated or deleted
+    op.execute(
+        f"DELETE FROM langchain_pg_embedding d WHERE {LEGACY} "
+        "AND (d.cmetadata->>'doc_type' IS NULL OR d.cmetadata->>'doc_id' IS NULL)"
+    )
+    # Documents already re-ingested under their new id
+    op.execute(
+        f"DELETE FROM langchain_pg_embedding d WHERE {LEGACY} AND EXISTS ("
+        "SELECT 1 FROM langchain_pg_embedding n "
+        f"WHERE n.collection_id = d.collection_id AND n.custom_id = {NEW_ID})"
+    )
+    # Ingestion used to add a fresh copy on every run; keep one per document
+    op.execute(
+        f"DELETE FROM langchain_pg_embedding d USING langchain_pg_embedding k "
+        f"WHERE {LEGACY} AND (k.custom_id IS NULL OR k.custom_id NOT LIKE '%:%') "
+        "AND k.collection_id = d.collection_id "
+        "AND k.cmetadata->>'doc_type' = d.cmetadata->>'doc_type' "
+        "AND k.cmetadata->>'doc_id' = d.cmetadata->>'doc_id' "
+        "AND d.uuid < k.uuid"
+    )
+    op.execute(f"UPDATE langchain_pg_embedding d SET custom_id = {NEW_ID} WHERE {LEGACY}")
+
+
+def downgrade():
+    # The UUIDs were random and nothing referenced them; there is nothing to restore
+    pass
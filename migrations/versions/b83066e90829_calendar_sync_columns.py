@@ -0,0 +1,30 @@
+"""Track recurring series and their expanded instances on events
+
+Revision ID: b83066e90829
+Revises: a4c82e17d3f5
+Create Date: 2026-10-19 10:04:17.220913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b83066e90829'
+down_revision = 'a4c82e17d3f5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('recurring_event_id', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('is_series', sa.Boolean(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_events_recurring_event_id'), ['recurring_event_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_events_recurring_event_id'))
+        batch_op.drop_column('is_series')
+        batch_op.drop_column('recurring_event_id')
@@ -0,0 +1,45 @@
+"""Add email_attachments and attachment_texts
+
+Revision ID: c41d7e9a02b6
+Revises: 605288da50e3
+Create Date: 2026-10-19 15:02:11.408233
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d7e9a02b6'
+down_revision = '605288da50e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('attachment_texts',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('mime_type', sa.String(), nullable=True),
+    sa.Column('text', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+    op.create_table('email_attachments',
+    sa.Column('email_id', sa.String(), nullable=False),
+    sa.Column('part_id', sa.String(), nullable=False),
+    sa.Column('filename', sa.String(), nullable=True),
+    sa.Column('mime_type', sa.String(), nullable=True),
+    sa.Column('size', sa.Integer(), nullable=True),
+    sa.Column('sha256', sa.String(length=64), nullable=True),
+    sa.PrimaryKeyConstraint('email_id', 'part_id')
+    )
+    with op.batch_alter_table('email_attachments', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_email_attachments_sha256'), ['sha256'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('email_attachments', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_email_attachments_sha256'))
+
+    op.drop_table('email_attachments')
+    op.drop_table('attachment_texts')
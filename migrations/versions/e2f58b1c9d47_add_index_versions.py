@@ -0,0 +1,56 @@
+"""Add index_versions and tag embeddings with their collection
+
+Revision ID: e2f58b1c9d47
+Revises: 7a9c3f1d5e20
+Create Date: 2026-10-19 16:31:05.662817
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e2f58b1c9d47'
+down_revision = '7a9c3f1d5e20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    index_versions = op.create_table('index_versions',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('collection', sa.String(), nullable=False),
+    sa.Column('model', sa.String(), nullable=False),
+    sa.Column('dimensions', sa.Integer(), nullable=True),
+    sa.Column('chunk_chars', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=True),
+    sa.Column('cursor', sa.String(), nullable=True),
+    sa.Column('processed', sa.Integer(), nullable=True),
+    sa.Column('report', sa.JSON(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('activated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('collection')
+    )
+    # Everything indexed so far lives in PGVector's default collection
+    op.bulk_insert(index_versions, [{
+        'collection': 'langchain',
+        'model': 'text-embedding-ada-002',
+        'dimensions': None,
+        'chunk_chars': 2000,
+        'status': 'active',
+        'processed': 0,
+    }])
+    op.execute("UPDATE index_versions SET created_at = now(), activated_at = now()")
+
+    with op.batch_alter_table('embeddings', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('collection', sa.String(), server_default='langchain', nullable=False))
+        batch_op.create_index('ix_embeddings_collection_doc', ['collection', 'doc_type', 'doc_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('embeddings', schema=None) as batch_op:
+        batch_op.drop_index('ix_embeddings_collection_doc')
+        batch_op.drop_column('collection')
+
+    op.drop_table('index_versions')
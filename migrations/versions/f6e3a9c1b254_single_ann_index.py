@@ -0,0 +1,54 @@
+"""Keep only the configured ANN index; stop storing vectors twice
+
+Revision ID: f6e3a9c1b254
+Revises: 3b7d0e6f9a12
+Create Date: 2026-10-19 21:12:05.381644
+
+"""
+import os
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f6e3a9c1b254'
+down_revision = '3b7d0e6f9a12'
+branch_labels = None
+depends_on = None
+
+ANN_INDEXES = {
+    'halfvec': ("ix_embeddings_vector_halfvec", "(vector::halfvec(1536)) halfvec_cosine_ops"),
+    'binary': ("ix_embeddings_vector_binary", "(binary_quantize(vector)::bit(1536)) bit_hamming_ops"),
+}
+
+
+def upgrade():
+    # Earlier revisions built both graphs whatever VECTOR_SEARCH_MODE was
+    mode = os.getenv("VECTOR_SEARCH_MODE", "float32")
+    for index_mode, (name, expression) in ANN_INDEXES.items():
+        if index_mode == mode:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON embeddings USING hnsw ({expression})")
+        else:
+            op.execute(f"DROP INDEX IF EXISTS {name}")
+
+    # Search reads full vectors from `embeddings`; PGVector only has to keep the
+    # text and metadata of those documents. Other sizes stay where they are.
+    if op.get_bind().execute(sa.text("SELECT to_regclass('langchain_pg_embedding')")).scalar() is not None:
+        op.execute(
+            "UPDATE langchain_pg_embedding d SET embedding = NULL "
+            "FROM embeddings e, langchain_pg_collection c "
+            "WHERE c.name = e.collection AND d.collection_id = c.uuid "
+            "AND d.custom_id = e.doc_type || ':' || e.doc_id AND d.embedding IS NOT NULL"
+        )
+
+
+def downgrade():
+    if op.get_bind().execute(sa.text("SELECT to_regclass('langchain_pg_embedding')")).scalar() is not None:
+        op.execute(
+            "UPDATE langchain_pg_embedding d SET embedding = e.vector "
+            "FROM embeddings e, langchain_pg_collection c "
+            "WHERE c.name = e.collection AND d.collection_id = c.uuid "
+            "AND d.custom_id = e.doc_type || ':' || e.doc_id AND d.embedding IS NULL"
+        )
+    for name, expression in ANN_INDEXES.values():
+        op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON embeddings USING hnsw ({expression})")
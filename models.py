@@ -1,9 +1,25 @@
-from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy
 from pgvector.sqlalchemy import Vector
+from sqlalchemy import DDL, event
 from datetime import datetime
+from database import get_engine
+
+class SQLAlchemy(_SQLAlchemy):
+    def _make_engine(self, bind_key, options, app):
+        # The default bind reuses the process-wide pool so the ORM, the vector
+        # store and background workers don't each hold their own connections
+        if bind_key is None:
+            return get_engine(options["url"])
+        return super()._make_engine(bind_key, options, app)
 
 db = SQLAlchemy()
 
+EMBEDDING_DIM = 1536
+# PGVector's default collection, which held every document before index versions existed
+LEGACY_COLLECTION = 'langchain'
+# Partition date for documents that have none; they land in the oldest, coldest range
+UNDATED = datetime(1970, 1, 1)
+
 class Email(db.Model):
     __tablename__ = 'emails'
     id = db.Column(db.String, primary_key=True)
@@ -11,11 +27,40 @@ class Email(db.Model):
     sender = db.Column(db.String, nullable=False)          
     sender_name = db.Column(db.String, nullable=True)     
     subject = db.Column(db.String)
-    date = db.Column(db.DateTime)
+    # Gmail's internalDate (UTC); the partition key, so it's part of the primary key
+    date = db.Column(db.DateTime, primary_key=True)
     snippet = db.Column(db.Text)
     body = db.Column(db.Text)
     raw = db.Column(db.JSON) 
 
+    __table_args__ = {'postgresql_partition_by': 'RANGE (date)'}
+
+class EmailThread(db.Model):
+    __tablename__ = 'email_threads'
+    id = db.Column(db.String, primary_key=True)
+    subject = db.Column(db.String)
+    participants = db.Column(db.JSON)
+    segments = db.Column(db.JSON)      # [{id, date, from, text}] with quoted history stripped
+    last_date = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class EmailAttachment(db.Model):
+    __tablename__ = 'email_attachments'
+    email_id = db.Column(db.String, primary_key=True)
+    part_id = db.Column(db.String, primary_key=True)
+    filename = db.Column(db.String)
+    mime_type = db.Column(db.String)
+    size = db.Column(db.Integer)
+    sha256 = db.Column(db.String(64), index=True)
+
+class AttachmentText(db.Model):
+    """Extracted text keyed by content hash, so a file forwarded around is parsed once."""
+    __tablename__ = 'attachment_texts'
+    sha256 = db.Column(db.String(64), primary_key=True)
+    mime_type = db.Column(db.String)
+    text = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
 class CalendarEvent(db.Model):
     __tablename__ = "events"
     id = db.Column(db.String, primary_key=True)
@@ -23,13 +68,26 @@ class CalendarEvent(db.Model):
     start = db.Column(db.DateTime)
     end = db.Column(db.DateTime)
     raw = db.Column(db.JSON)
+    recurring_event_id = db.Column(db.String, nullable=True, index=True)
+    is_series = db.Column(db.Boolean, default=False)
 
 class Embedding(db.Model):
     __tablename__ = "embeddings"
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     doc_type = db.Column(db.String, nullable=False)
     doc_id = db.Column(db.String, nullable=False)
-    vector = db.Column(Vector(1536), nullable=False)
+    vector = db.Column(Vector(EMBEDDING_DIM), nullable=False)
+    collection = db.Column(db.String, nullable=False, default=LEGACY_COLLECTION,
+                           server_default=LEGACY_COLLECTION)
+    # When the document happened; the partition key that recency search prunes on
+    doc_date = db.Column(db.DateTime, primary_key=True, default=UNDATED,
+                         server_default=db.text("'1970-01-01'"))
+
+    __table_args__ = (
+        db.Index('ix_embeddings_collection_doc', 'collection', 'doc_type', 'doc_id'),
+        # The ANN index depends on VECTOR_SEARCH_MODE; vectorstore.sync_ann_index builds it
+        {'postgresql_partition_by': 'RANGE (doc_date)'},
+    )
 
 class Task(db.Model):
     __tablename__ = 'tasks'
@@ -39,4 +97,38 @@ class Task(db.Model):
     status = db.Column(db.String, default='pending')          
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
-    related_thread = db.Column(db.String, nullable=True) 
\ No newline at end of file
+    related_thread = db.Column(db.String, nullable=True) 
+
+class SyncState(db.Model):
+    __tablename__ = 'sync_state'
+    key = db.Column(db.String, primary_key=True)
+    cursor = db.Column(db.String, nullable=True)
+    status = db.Column(db.String, default='pending')
+    processed = db.Column(db.Integer, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class IndexVersion(db.Model):
+    """A vector collection built with one embedding configuration.
+
+    Exactly one version is active and serves search. A reindex builds the next
+    one alongside it ('building') and switches over once it validates.
+    """
+    __tablename__ = 'index_versions'
+    id = db.Column(db.Integer, primary_key=True)
+    collection = db.Column(db.String, unique=True, nullable=False)
+    model = db.Column(db.String, nullable=False)
+    dimensions = db.Column(db.Integer, nullable=True)     # None: the model's native size
+    chunk_chars = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String, default='building')     # building, active, retired, failed
+    cursor = db.Column(db.String, nullable=True)          # "<doc_type>|<last key>" to resume from
+    processed = db.Column(db.Integer, default=0)
+    report = db.Column(db.JSON, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    activated_at = db.Column(db.DateTime, nullable=True)
+
+# create_all only makes the partitioned parents; rows need somewhere to land
+# until partitions.ensure_partitions adds the monthly ranges
+for _table in (Email.__table__, Embedding.__table__):
+    event.listen(_table, 'after_create', DDL(
+        "CREATE TABLE IF NOT EXISTS %(table)s_default PARTITION OF %(table)s DEFAULT"
+    ))
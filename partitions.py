@@ -0,0 +1,197 @@
+"""Monthly range partitions of `emails` and `embeddings`.
+
+Both tables are partitioned by the date of what they hold (Gmail's internalDate,
+a thread's last message, an event's start), one partition per calendar month
+plus a DEFAULT partition for anything no month covers yet. Search reads the
+newest months first (vectorstore.recency_search), so the HNSW graphs it walks
+stay the size of a few months however long the history gets. Old months can be
+moved to a cheaper tablespace, detached or dropped without touching the rest.
+"""
+import re
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import text
+from database import get_engine, lift_statement_timeout
+
+PARTITIONED = {'emails': 'date', 'embeddings': 'doc_date'}
+MONTHS_AHEAD = 3
+
+def month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+def add_months(month, n):
+    y, m = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return datetime(y, m + 1, 1)
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+def _quote(conn, name):
+    return conn.dialect.identifier_preparer.quote(name)
+
+def _bound(month):
+    # ATTACH PARTITION takes no bind parameters; the literal comes from a datetime, never from input
+    return f"TIMESTAMP '{month:%Y-%m-%d}'"
+
+def _existing(conn, table):
+    """{month: name} of the monthly partitions attached to `table`."""
+    rows = conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = CAST(:table AS regclass)"
+    ), {"table": table})
+    months = {}
+    for (name,) in rows:
+        m = re.fullmatch(rf"{table}_p(\d{{4}})_(\d{{2}})", name)
+        if m:
+            months[datetime(int(m.group(1)), int(m.group(2)), 1)] = name
+    return months
+
+def _create(table, month):
+    """Create and attach `table`'s partition for `month`; False if another process got there first."""
+    column, name, upper = PARTITIONED[table], partition_name(table, month), add_months(month, 1)
+    with get_engine().begin() as conn:
+        # Moving rows out of the default partition and building the HNSW indexes take a while
+        lift_statement_timeout(conn)
+        q_table, q_name, q_column = _quote(conn, table), _quote(conn, name), _quote(conn, column)
+        q_default = _quote(conn, f"{table}_default")
+        # Rows for this month may already sit in the default partition, and Postgres
+        # won't attach a partition whose range the default still holds rows for.
+        # Lock it so nothing new lands there between the move and the attach. The
+        # lock also serializes workers creating the same month at startup, so look
+        # again once it's held.
+        conn.execute(text(f"LOCK TABLE {q_default} IN ACCESS EXCLUSIVE MODE"))
+        if month in _existing(conn, table):
+            return False
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {q_name} (LIKE {q_table} INCLUDING DEFAULTS INCLUDING STORAGE)"
+        ))
+        moved = conn.execute(text(
+            f"WITH moved AS (DELETE FROM {q_default} "
+            f"WHERE {q_column} >= :lower AND {q_column} < :upper RETURNING *) "
+            f"INSERT INTO {q_name} SELECT * FROM moved"
+        ), {"lower": month, "upper": upper}).rowcount
+        # Attaching also builds the parent's indexes (HNSW included) on the new table
+        conn.execute(text(
+            f"ALTER TABLE {q_table} ATTACH PARTITION {q_name} "
+            f"FOR VALUES FROM ({_bound(month)}) TO ({_bound(upper)})"
+        ))
+    current_app.logger.info(f"[Partitions] Created {name} ({moved} rows moved from {table}_default).")
+    return True
+
+def ensure_partitions(months_ahead=MONTHS_AHEAD, since=None):
+    """Create the monthly partitions from `since` (default: this month) to `months_ahead` months out.
+
+    Safe to run from several workers at once. Returns the names of the partitions this call created.
+    """
+    first = month_start(since or datetime.utcnow())
+    last = add_months(month_start(datetime.utcnow()), months_ahead)
+    with get_engine().connect() as conn:
+        existing = {table: _existing(conn, table) for table in PARTITIONED}
+    created = []
+    for table in PARTITIONED:
+        month = first
+        while month <= last:
+            if month not in existing[table] and _create(table, month):
+                created.append(partition_name(table, month))
+            month = add_months(month, 1)
+    global _ensured_from
+    _ensured_from = min(first, _ensured_from or first)
+    return created
+
+# Earliest month this process has already run ensure_partitions from
+_ensured_from = None
+
+def ensure_month(dt):
+    """Make sure rows dated `dt` get a monthly partition rather than the DEFAULT one.
+
+    For the write paths that reach back in time (the mailbox backfill); cheap
+    once the month has been ensured.
+    """
+    if _ensured_from is None or month_start(dt) < _ensured_from:
+        ensure_partitions(since=dt)
+
+def horizon(table='embeddings'):
+    """End of `table`'s newest monthly partition; rows dated later land in the DEFAULT partition."""
+    with get_engine().connect() as conn:
+        months = _existing(conn, table)
+    return add_months(max(months), 1) if months else None
+
+def partitions():
+    """(table, name, month, rows, size, tablespace) for every partition; month is None for the default."""
+    result = []
+    with get_engine().connect() as conn:
+        for table in PARTITIONED:
+            rows = conn.execute(text(
+                "SELECT c.relname, c.reltuples, pg_total_relation_size(c.oid) AS size, "
+                "COALESCE(t.spcname, 'pg_default') AS tablespace "
+                "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "LEFT JOIN pg_tablespace t ON t.oid = c.reltablespace "
+                "WHERE i.inhparent = CAST(:table AS regclass) ORDER BY c.relname"
+            ), {"table": table}).all()
+            months = {name: month for month, name in _existing(conn, table).items()}
+            result.extend(
+                (table, row.relname, months.get(row.relname), max(int(row.reltuples), 0),
+                 row.size, row.tablespace)
+                for row in rows
+            )
+    return result
+
+def _cold(before):
+    """(table, name) of the monthly partitions that end on or before `before`'s month."""
+    cutoff = month_start(before)
+    from vectorstore import hot_cutoff
+    if cutoff > hot_cutoff():
+        raise ValueError(f"{cutoff:%Y-%m} is inside the hot search window; pick an older month")
+    with get_engine().connect() as conn:
+        return [
+            (table, name)
+            for table in PARTITIONED
+            for month, name in sorted(_existing(conn, table).items())
+            if month < cutoff
+        ]
+
+def move_partitions(before, tablespace):
+    """Move the partitions older than `before` (and their indexes) to `tablespace`."""
+    moved = []
+    with get_engine().begin() as conn:
+        lift_statement_timeout(conn)
+        for table, name in _cold(before):
+            q_space = _quote(conn, tablespace)
+            conn.execute(text(f"ALTER TABLE {_quote(conn, name)} SET TABLESPACE {q_space}"))
+            indexes = conn.execute(text(
+                "SELECT indexname FROM pg_indexes WHERE tablename = :name"
+            ), {"name": name}).scalars().all()
+            for index in indexes:
+                conn.execute(text(f"ALTER INDEX {_quote(conn, index)} SET TABLESPACE {q_space}"))
+            moved.append(name)
+    return moved
+
+def detach_partitions(before):
+    """Detach the partitions older than `before`; they stay behind as plain tables, out of every query.
+
+    Reattach one with ALTER TABLE <table> ATTACH PARTITION <name> FOR VALUES FROM (...) TO (...).
+    """
+    detached = []
+    with get_engine().begin() as conn:
+        lift_statement_timeout(conn)
+        for table, name in _cold(before):
+            conn.execute(text(f"ALTER TABLE {_quote(conn, table)} DETACH PARTITION {_quote(conn, name)}"))
+            detached.append(name)
+    return detached
+
+def drop_partitions(before):
+    """Delete the partitions older than `before`, with the vector-store documents they index."""
+    dropped = []
+    with get_engine().begin() as conn:
+        lift_statement_timeout(conn)
+        for table, name in _cold(before):
+            if table == 'embeddings':
+                conn.execute(text(
+                    f"DELETE FROM langchain_pg_embedding d "
+                    f"USING {_quote(conn, name)} e, langchain_pg_collection c "
+                    f"WHERE c.name = e.collection AND d.collection_id = c.uuid "
+                    f"AND d.custom_id = e.doc_type || ':' || e.doc_id"
+                ))
+            conn.execute(text(f"DROP TABLE {_quote(conn, name)}"))
+            dropped.append(name)
+    return dropped
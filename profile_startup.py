@@ -0,0 +1,62 @@
+"""Profile cold start: `import app` followed by `create_app()` in a fresh interpreter.
+
+    python profile_startup.py [--top 15] [--budget 1.0]
+
+Prints the wall time and the slowest imports (by cumulative and self time) as
+reported by `python -X importtime`. Exits non-zero when the wall time exceeds
+`--budget` seconds, so it can run as a startup regression check.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+SNIPPET = (
+    "import time; t = time.perf_counter(); "
+    "import app; app.create_app(); "
+    "print(time.perf_counter() - t)"
+)
+
+def _parse_importtime(stderr):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.rstrip(), int(self_us), int(cumulative_us)))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    # Nothing connects at startup, so a placeholder URL is enough to build the app
+    env.setdefault("DATABASE_URL", "postgresql://localhost/startup_profile")
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SNIPPET],
+        capture_output=True, text=True, env=env,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        sys.stderr.write(proc.stderr)
+        return proc.returncode
+
+    elapsed = float(proc.stdout.strip().splitlines()[-1])
+    rows = _parse_importtime(proc.stderr)
+
+    print(f"import app + create_app(): {elapsed:.3f}s (budget {args.budget:.3f}s)\n")
+    print("Top-level imports by cumulative time:")
+    top_level = [r for r in rows if not r[0].startswith("   ")]
+    for name, _, cumulative in sorted(top_level, key=lambda r: -r[2])[:args.top]:
+        print(f"  {cumulative / 1e6:7.3f}s  {name.strip()}")
+    print("\nModules by self time:")
+    for name, self_us, _ in sorted(rows, key=lambda r: -r[1])[:args.top]:
+        print(f"  {self_us / 1e6:7.3f}s  {name.strip()}")
+
+    return 0 if elapsed <= args.budget else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
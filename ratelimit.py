@@ -0,0 +1,364 @@
+import asyncio
+import os
+import random
+import socket
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from http.client import RemoteDisconnected
+from urllib3.exceptions import ProtocolError
+
+# Gmail charges quota units per method, not per request
+# (https://developers.google.com/gmail/api/reference/quota).
+GMAIL_QUOTA_UNITS = {
+    "gmail.users.messages.list": 5,
+    "gmail.users.messages.get": 5,
+    "gmail.users.messages.send": 100,
+    "gmail.users.messages.attachments.get": 5,
+    "gmail.users.threads.list": 10,
+    "gmail.users.threads.get": 10,
+    "gmail.users.history.list": 2,
+    "gmail.users.getProfile": 1,
+}
+DEFAULT_GMAIL_UNITS = 5
+
+GMAIL_UNITS_PER_SECOND = float(os.getenv("GMAIL_UNITS_PER_SECOND", 250))
+CALENDAR_QPS = float(os.getenv("CALENDAR_QPS", 10))
+OPENAI_TOKENS_PER_MINUTE = float(os.getenv("OPENAI_TOKENS_PER_MINUTE", 150000))
+MAX_CONCURRENCY = int(os.getenv("RATE_LIMIT_MAX_CONCURRENCY", 16))
+# Interactive chat gets its own concurrency so ingestion and backfill can't queue it
+CHAT_CONCURRENCY = int(os.getenv("CHAT_CONCURRENCY", 8))
+CHAT_MAX_CONCURRENCY = int(os.getenv("CHAT_MAX_CONCURRENCY", 64))
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "RATE_LIMIT_EXCEEDED"}
+TRANSIENT_STATUSES = {500, 502, 503, 504}
+NETWORK_ERRORS = (ProtocolError, RemoteDisconnected, ConnectionError, socket.timeout)
+
+
+class TokenBucket:
+    """Refills `rate` units per second up to `capacity`; `acquire` blocks until enough are available."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_take(self, amount):
+        """Take `amount` if it's available and return 0, else return how long to wait."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            wait = self._paused_until - now
+            if wait <= 0:
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return 0.0
+                wait = (amount - self._tokens) / self.rate
+            return wait
+
+    def acquire(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        while True:
+            wait = self._try_take(amount)
+            if not wait:
+                return
+            time.sleep(wait)
+
+    async def acquire_async(self, amount=1):
+        amount = min(float(amount), self.capacity)
+        while True:
+            wait = self._try_take(amount)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Stop handing out tokens for `seconds`, e.g. to honour a Retry-After header."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+class AIMDLimiter:
+    """Concurrency limit with additive increase on success and multiplicative decrease on throttling."""
+
+    def __init__(self, initial=4, minimum=1, maximum=MAX_CONCURRENCY, decrease=0.5, cooldown=1.0):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._async_waiters = []
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            self._leave()
+
+    @asynccontextmanager
+    async def slot_async(self):
+        # Shares the count with `slot`, so threads and coroutines draw on one limit
+        while True:
+            with self._cond:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    break
+                loop = asyncio.get_running_loop()
+                waiter = (loop, loop.create_future())
+                self._async_waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self._cond:
+                    if waiter in self._async_waiters:
+                        self._async_waiters.remove(waiter)
+        try:
+            yield
+        finally:
+            self._leave()
+
+    def _notify(self):
+        """Wake blocked threads and coroutines; call with `_cond` held."""
+        self._cond.notify_all()
+        for loop, future in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, future)
+            except RuntimeError:
+                pass    # that loop has closed
+        self._async_waiters.clear()
+
+    def _leave(self):
+        with self._cond:
+            self.in_flight -= 1
+            self._notify()
+
+    def on_success(self):
+        # +1 per "window" of `limit` successful calls
+        with self._cond:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._notify()
+
+    def on_throttle(self):
+        # A burst of concurrent 429s should only halve the limit once
+        with self._cond:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.cooldown:
+                self.limit = max(self.minimum, self.limit * self.decrease)
+                self._last_decrease = now
+
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class QuotaGate:
+    """Rate bucket + AIMD concurrency + retry policy for one upstream API."""
+
+    def __init__(self, name, bucket, limiter=None):
+        self.name = name
+        self.bucket = bucket
+        self.limiter = limiter or AIMDLimiter()
+        self._stats = {"calls": 0, "throttled": 0, "retries": 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def stats(self):
+        """A consistent copy of the call counters."""
+        with self._stats_lock:
+            return dict(self._stats)
+
+    def _count(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def call(self, func, cost=1):
+        for attempt in range(MAX_ATTEMPTS):
+            self.bucket.acquire(cost)
+            with self.limiter.slot():
+                self._count("calls")
+                try:
+                    result = func()
+                except Exception as e:
+                    error = e
+                    throttled, transient, retry_after = _classify(e)
+                    if not (throttled or transient) or attempt == MAX_ATTEMPTS - 1:
+                        raise
+                else:
+                    self.limiter.on_success()
+                    return result
+            time.sleep(self._retry_delay(attempt, error, throttled, retry_after))
+
+    async def call_async(self, func, cost=1):
+        """`call` for a coroutine function; waits on the event loop instead of blocking a thread."""
+        for attempt in range(MAX_ATTEMPTS):
+            await self.bucket.acquire_async(cost)
+            async with self.limiter.slot_async():
+                self._count("calls")
+                try:
+                    result = await func()
+                except Exception as e:
+                    error = e
+                    throttled, transient, retry_after = _classify(e)
+                    if not (throttled or transient) or attempt == MAX_ATTEMPTS - 1:
+                        raise
+                else:
+                    self.limiter.on_success()
+                    return result
+            await asyncio.sleep(self._retry_delay(attempt, error, throttled, retry_after))
+
+    def _retry_delay(self, attempt, error, throttled, retry_after):
+        self._count("retries")
+        if throttled:
+            self._count("throttled")
+            self.limiter.on_throttle()
+        delay = retry_after if retry_after is not None else _backoff(attempt)
+        if throttled and retry_after is not None:
+            self.bucket.pause(retry_after)
+        print(f"[RateLimit] {self.name} attempt {attempt+1} failed ({error!r}); retrying in {delay:.1f}s")
+        return delay
+
+
+def _backoff(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+
+
+def _parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def _google_reasons(err):
+    details = err.error_details if isinstance(err.error_details, list) else []
+    return {d.get("reason") for d in details if isinstance(d, dict)}
+
+
+def _json_reasons(response):
+    """Google error reasons from a REST error body."""
+    try:
+        error = response.json().get("error", {})
+    except ValueError:
+        return set()
+    items = (error.get("errors") or []) + (error.get("details") or [])
+    return {d.get("reason") for d in items if isinstance(d, dict)}
+
+
+def _classify(exc):
+    """Return (throttled, transient, retry_after_seconds) for an exception."""
+    # Only reached on failure, by which point the client libraries are loaded anyway
+    import httplib2
+    import httpx
+    import openai
+    from googleapiclient.errors import HttpError
+
+    network_errors = NETWORK_ERRORS + (
+        httplib2.ServerNotFoundError, openai.error.APIConnectionError,
+        openai.error.Timeout, openai.error.TryAgain, httpx.TransportError,
+    )
+    if isinstance(exc, httpx.HTTPStatusError):
+        status = exc.response.status_code
+        retry_after = _parse_retry_after(exc.response.headers.get("retry-after"))
+        throttled = status == 429 or (
+            status == 403 and bool(_json_reasons(exc.response) & RATE_LIMIT_REASONS)
+        )
+        return throttled, status in TRANSIENT_STATUSES, retry_after
+    if isinstance(exc, HttpError):
+        status = exc.resp.status
+        retry_after = _parse_retry_after(exc.resp.get("retry-after"))
+        throttled = status == 429 or (status == 403 and bool(_google_reasons(exc) & RATE_LIMIT_REASONS))
+        return throttled, status in TRANSIENT_STATUSES, retry_after
+    if isinstance(exc, openai.error.OpenAIError):
+        retry_after = _parse_retry_after(exc.headers.get("retry-after"))
+        throttled = isinstance(exc, openai.error.RateLimitError) or exc.http_status == 429
+        transient = (
+            isinstance(exc, network_errors)
+            or isinstance(exc, openai.error.ServiceUnavailableError)
+            or exc.http_status in TRANSIENT_STATUSES
+        )
+        return throttled, transient, retry_after
+    return False, isinstance(exc, network_errors), None
+
+
+gmail = QuotaGate("gmail", TokenBucket(GMAIL_UNITS_PER_SECOND))
+calendar = QuotaGate("calendar", TokenBucket(CALENDAR_QPS))
+openai_gate = QuotaGate(
+    "openai",
+    TokenBucket(OPENAI_TOKENS_PER_MINUTE / 60.0, capacity=OPENAI_TOKENS_PER_MINUTE),
+)
+# Same per-minute budget, separate concurrency: a backfill holding every openai_gate
+# slot doesn't make chat wait behind it
+chat_gate = QuotaGate(
+    "openai-chat", openai_gate.bucket,
+    AIMDLimiter(initial=CHAT_CONCURRENCY, maximum=CHAT_MAX_CONCURRENCY),
+)
+
+_local = threading.local()
+
+
+def authorized_http(creds):
+    """Per-thread authorized transport; httplib2 connections are not thread-safe."""
+    cached = getattr(_local, "http", None)
+    if cached is None or cached[0] is not creds:
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        cached = (creds, AuthorizedHttp(creds, http=httplib2.Http()))
+        _local.http = cached
+    return cached[1]
+
+
+def google_execute(request, http=None):
+    """Execute a googleapiclient request under the quota of the API it belongs to."""
+    method = request.methodId or ""
+    if method.startswith("gmail."):
+        gate, cost = gmail, GMAIL_QUOTA_UNITS.get(method, DEFAULT_GMAIL_UNITS)
+    else:
+        gate, cost = calendar, 1
+    return gate.call(lambda: request.execute(http=http), cost=cost)
+
+
+def estimate_tokens(text):
+    if isinstance(text, (list, tuple)):
+        return sum(estimate_tokens(t) for t in text)
+    return max(1, len(text or "") // 4)
+
+
+def openai_call(func, tokens, **kwargs):
+    """Call an openai 0.28 API function, charging `tokens` against the per-minute budget."""
+    return openai_gate.call(lambda: func(**kwargs), cost=tokens)
+
+
+def chat_call(func, tokens, **kwargs):
+    """`openai_call` for interactive chat requests, which have their own concurrency limit."""
+    return chat_gate.call(lambda: func(**kwargs), cost=tokens)
@@ -0,0 +1,207 @@
+import os
+import time
+from datetime import datetime
+from sqlalchemy import text
+from database import get_engine, lift_statement_timeout
+from documents import DOC_TYPES, MAX_EMBED_CHARS, iter_documents, source_key
+from ingestion import embed_texts, store_embeddings
+from models import db, IndexVersion
+from ratelimit import TokenBucket, estimate_tokens
+from vectorstore import (
+    LEGACY_CONFIG, VERSION_TTL, IndexConfig, live_versions, search_by_vector
+)
+
+BATCH_SIZE = 100
+# Live ingestion and chat share the OpenAI quota, so the rebuild only gets a slice of it
+REINDEX_TOKENS_PER_MINUTE = float(os.getenv("REINDEX_TOKENS_PER_MINUTE", 50000))
+MIN_COVERAGE = float(os.getenv("REINDEX_MIN_COVERAGE", 0.98))
+MIN_SELF_RECALL = float(os.getenv("REINDEX_MIN_SELF_RECALL", 0.9))
+VALIDATION_SAMPLE = 50
+
+_throttle = TokenBucket(REINDEX_TOKENS_PER_MINUTE / 60.0, capacity=REINDEX_TOKENS_PER_MINUTE / 6)
+
+def _config(version):
+    return IndexConfig(version.collection, version.model, version.dimensions, version.chunk_chars)
+
+def _ensure_active_row():
+    # Databases created with create_all have no row for the legacy collection yet
+    if IndexVersion.query.filter_by(status='active').first() is None:
+        db.session.add(IndexVersion(
+            collection=LEGACY_CONFIG.collection, model=LEGACY_CONFIG.model,
+            chunk_chars=LEGACY_CONFIG.chunk_chars, status='active',
+            activated_at=datetime.utcnow(),
+        ))
+        db.session.commit()
+
+def start_version(model, dimensions=None, chunk_chars=MAX_EMBED_CHARS):
+    """Register a new version as 'building'; from here on live writes are mirrored into it."""
+    _ensure_active_row()
+    version = IndexVersion(
+        collection=f"docs_{datetime.utcnow():%Y%m%d%H%M%S}",
+        model=model, dimensions=dimensions, chunk_chars=chunk_chars,
+        status='building', processed=0,
+    )
+    db.session.add(version)
+    db.session.commit()
+    return version
+
+def build(version_id):
+    """Embed every stored document into the version's collection, resuming from its cursor."""
+    version = db.session.get(IndexVersion, version_id)
+    config = _config(version)
+    resume_type, resume_after = version.cursor.split('|', 1) if version.cursor else (DOC_TYPES[0], None)
+
+    for doc_type in DOC_TYPES[DOC_TYPES.index(resume_type):]:
+        after = resume_after if doc_type == resume_type else None
+        for last_key, docs in iter_documents(doc_type, config.chunk_chars, after, BATCH_SIZE):
+            if docs:
+                texts = [doc_text for _, doc_text, _ in docs]
+                _throttle.acquire(estimate_tokens(texts))
+                vectors = embed_texts(texts, config)
+                store_embeddings(doc_type, [
+                    (doc_id, doc_text, vector, metadata)
+                    for (doc_id, doc_text, metadata), vector in zip(docs, vectors)
+                ], config)
+
+            version = db.session.get(IndexVersion, version_id)
+            if version.status != 'building':
+                print(f"[Reindex] {config.collection} is now {version.status}; stopping.")
+                return False
+            version.cursor = f"{doc_type}|{last_key}"
+            version.processed = (version.processed or 0) + len(docs)
+            db.session.commit()
+            print(f"[Reindex] {config.collection}: {version.processed} documents ({doc_type}).")
+    return True
+
+def _source_keys(collection):
+    """((doc_type, source key) set, number of rows without a "<doc_type>:<doc_id>" id)."""
+    with get_engine().connect() as conn:
+        rows = conn.execute(text(
+            "SELECT d.custom_id FROM langchain_pg_embedding d "
+            "JOIN langchain_pg_collection c ON c.uuid = d.collection_id "
+            "WHERE c.name = :name"
+        ), {"name": collection})
+        keys, unkeyed = set(), 0
+        for row in rows:
+            # Rows the legacy re-keying migration couldn't place; they can't be compared
+            if not row.custom_id or ':' not in row.custom_id:
+                unkeyed += 1
+                continue
+            doc_type, doc_id = row.custom_id.split(':', 1)
+            keys.add((doc_type, source_key(doc_type, doc_id)))
+        return keys, unkeyed
+
+def validate(version_id):
+    """Check the new collection before it serves; returns (ok, report).
+
+    Coverage: share of the active version's source rows that the new one also
+    indexes (chunking may change how many documents each row yields). Self-recall:
+    share of sampled documents found in their own top 5 when queried with their text,
+    through search_by_vector: the same ANN index, rerank and recency tiers that
+    will serve once the version is active.
+    """
+    version = db.session.get(IndexVersion, version_id)
+    config = _config(version)
+    active = live_versions(refresh=True)[0]
+    (old, unkeyed), (new, _) = _source_keys(active.collection), _source_keys(config.collection)
+    coverage = len(old & new) / len(old) if old else 1.0
+
+    with get_engine().connect() as conn:
+        sample = conn.execute(text(
+            "SELECT d.custom_id, d.document FROM langchain_pg_embedding d "
+            "JOIN langchain_pg_collection c ON c.uuid = d.collection_id "
+            "WHERE c.name = :name ORDER BY random() LIMIT :n"
+        ), {"name": config.collection, "n": VALIDATION_SAMPLE}).all()
+    documents = [row.document for row in sample]
+    _throttle.acquire(estimate_tokens(documents))
+    vectors = embed_texts(documents, config) if documents else []
+    found = 0
+    for row, vector in zip(sample, vectors):
+        hits = search_by_vector(vector, 5, config=config)
+        found += any(f"{hit.get('doc_type')}:{hit.get('doc_id')}" == row.custom_id for hit in hits)
+    self_recall = found / len(sample) if sample else 1.0
+
+    report = {
+        'compared_to': active.collection,
+        'coverage': round(coverage, 4),
+        'missing': len(old - new),
+        'unkeyed': unkeyed,
+        'source_rows': len(new),
+        'self_recall': round(self_recall, 4),
+        'sampled': len(sample),
+        'checked_at': datetime.utcnow().isoformat(),
+    }
+    ok = coverage >= MIN_COVERAGE and self_recall >= MIN_SELF_RECALL
+    version.report = report
+    db.session.commit()
+    return ok, report
+
+def activate(collection):
+    """Make `collection` the version that serves search.
+
+    The old version is retired in the same transaction, so there is always exactly
+    one active version. Workers pick the change up within VERSION_TTL seconds and
+    both collections stay searchable until they do.
+    """
+    version = IndexVersion.query.filter_by(collection=collection).first()
+    if version is None:
+        raise ValueError(f"No index version {collection!r}")
+    _ensure_active_row()
+    IndexVersion.query.filter(
+        IndexVersion.status == 'active', IndexVersion.id != version.id
+    ).update({'status': 'retired'}, synchronize_session=False)
+    version.status = 'active'
+    version.activated_at = datetime.utcnow()
+    db.session.commit()
+    live_versions(refresh=True)
+
+def drop(collection):
+    """Delete a retired or failed version's vectors and its record."""
+    version = IndexVersion.query.filter_by(collection=collection).first()
+    if version is None:
+        raise ValueError(f"No index version {collection!r}")
+    if version.status in ('active', 'building'):
+        raise ValueError(f"{collection} is {version.status}; only retired or failed versions can be dropped")
+    # A whole collection's vectors; far more than the request statement timeout allows for
+    with get_engine().begin() as conn:
+        lift_statement_timeout(conn)
+        conn.execute(text("DELETE FROM embeddings WHERE collection = :name"), {"name": collection})
+        conn.execute(text(
+            "DELETE FROM langchain_pg_embedding d USING langchain_pg_collection c "
+            "WHERE c.uuid = d.collection_id AND c.name = :name"
+        ), {"name": collection})
+        conn.execute(text("DELETE FROM langchain_pg_collection WHERE name = :name"), {"name": collection})
+    db.session.delete(version)
+    db.session.commit()
+
+def reindex(model, dimensions=None, chunk_chars=MAX_EMBED_CHARS, activate_when_valid=True):
+    """Build a new version (or resume the one being built), validate it and switch over.
+
+    Must be called with an app context. Search keeps using the active version
+    throughout; only `activate` changes what it reads.
+    """
+    version = IndexVersion.query.filter_by(status='building').order_by(IndexVersion.id).first()
+    if version is not None:
+        print(f"[Reindex] Resuming {version.collection} ({version.model}) at {version.cursor or 'the start'}.")
+    else:
+        version = start_version(model, dimensions, chunk_chars)
+        print(f"[Reindex] Building {version.collection} with {model}.")
+        # Let every worker notice the new version and start mirroring writes into it
+        # before the pass begins, so nothing lands between the two
+        time.sleep(VERSION_TTL)
+    version_id, collection = version.id, version.collection
+
+    if not build(version_id):
+        return False
+    ok, report = validate(version_id)
+    print(f"[Reindex] Validation for {collection}: {report}")
+    if not ok:
+        version = db.session.get(IndexVersion, version_id)
+        version.status = 'failed'
+        db.session.commit()
+        print(f"[Reindex] {collection} failed validation; the active version is unchanged.")
+        return False
+    if activate_when_valid:
+        activate(collection)
+        print(f"[Reindex] {collection} is now active.")
+    return True
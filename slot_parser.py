@@ -0,0 +1,242 @@
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Paths are tried in this order; the general parsers only run when the cheap ones miss
+PATHS = ("offered", "pattern", "dateparser", "dateutil")
+
+_WEEKDAYS = {
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+}
+_MONTHS = {
+    "jan": 1, "feb": 2, "mar": 3, "apr": 4, "may": 5, "jun": 6,
+    "jul": 7, "aug": 8, "sep": 9, "oct": 10, "nov": 11, "dec": 12,
+}
+_ORDINALS = {
+    "first": 0, "1st": 0, "second": 1, "2nd": 1, "third": 2, "3rd": 2,
+    "fourth": 3, "4th": 3, "fifth": 4, "5th": 4,
+}
+
+_WEEKDAY_RE = re.compile(
+    r"\b(monday|mon|tuesday|tues|tue|wednesday|wed|thursday|thurs|thur|thu"
+    r"|friday|fri|saturday|sat|sunday|sun)s?\b"
+)
+_TIME_MER_RE = re.compile(r"\b(\d{1,2})(?::(\d{2}))?\s*([ap])\.?m\b\.?")
+_TIME_COLON_RE = re.compile(r"\b(\d{1,2}):(\d{2})\b")
+_TIME_AT_RE = re.compile(r"\bat\s+(\d{1,2})\b(?!\s*[/:])")
+_NOON_RE = re.compile(r"\bnoon\b")
+_MONTH_DAY_RE = re.compile(
+    r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+(\d{1,2})(?:st|nd|rd|th)?\b"
+)
+_NUMERIC_DATE_RE = re.compile(r"\b(\d{1,2})/(\d{1,2})\b")
+# "the 20th", "20th", "the 20"
+_DAY_OF_MONTH_RE = re.compile(r"\b(?:the\s+)?(\d{1,2})(?:st|nd|rd|th)\b|\bthe\s+(\d{1,2})\b(?!\s*[:/])")
+_PART_OF_DAY_RE = re.compile(r"\b(morning|afternoon|evening|tonight)\b")
+_PART_OF_DAY_HOURS = {
+    "morning": (5, 12), "afternoon": (12, 17), "evening": (17, 24), "tonight": (17, 24),
+}
+_RELATIVE_RE = re.compile(r"\b(today|tomorrow)\b")
+_OPTION_RE = re.compile(r"(?:\boption|\bslot|#)\s*(\d)\b")
+_ORDINAL_RE = re.compile(r"\b(first|1st|second|2nd|third|3rd|fourth|4th|fifth|5th)\b")
+# Snippets are flattened onto one line, so the quoted header can appear mid-string
+_QUOTE_RE = re.compile(r"\bOn\s.{0,200}?\bwrote:.*$", re.S)
+
+_lock = threading.Lock()
+_stats = {path: {"attempts": 0, "hits": 0, "seconds": 0.0} for path in PATHS}
+
+def clean_reply(snippet):
+    """Keep only the reply's own first line, without the quoted original."""
+    text = _QUOTE_RE.sub("", snippet or "")
+    return text.split("\n")[0].strip()
+
+def _record(path, hit, seconds):
+    with _lock:
+        _stats[path]["attempts"] += 1
+        _stats[path]["hits"] += int(hit)
+        _stats[path]["seconds"] += seconds
+
+def stats():
+    """Per-path attempts, hits and time spent, for reporting."""
+    with _lock:
+        return {
+            path: {
+                **s,
+                "avg_ms": 1000 * s["seconds"] / s["attempts"] if s["attempts"] else 0.0,
+            }
+            for path, s in _stats.items()
+        }
+
+def _time_of_day(text):
+    """Return (hour, minute, has_meridiem) or None."""
+    m = _TIME_MER_RE.search(text)
+    if m:
+        hour, minute = int(m.group(1)), int(m.group(2) or 0)
+        if not 1 <= hour <= 12 or minute > 59:
+            return None
+        hour = hour % 12 + (12 if m.group(3) == "p" else 0)
+        return hour, minute, True
+    if _NOON_RE.search(text):
+        return 12, 0, True
+    m = _TIME_COLON_RE.search(text) or _TIME_AT_RE.search(text)
+    if m:
+        hour = int(m.group(1))
+        minute = int(m.group(2)) if m.lastindex and m.lastindex >= 2 else 0
+        if hour > 23 or minute > 59:
+            return None
+        return hour, minute, hour > 12
+    return None
+
+def _weekdays(text):
+    return {_WEEKDAYS[m.group(1)[:3]] for m in _WEEKDAY_RE.finditer(text)}
+
+def _day_of_month(text):
+    m = _DAY_OF_MONTH_RE.search(text)
+    if not m:
+        return None
+    day = int(m.group(1) or m.group(2))
+    return day if 1 <= day <= 31 else None
+
+def _next_day_of_month(day, now):
+    """The next date (today included) that falls on `day` of a month."""
+    month = now.replace(day=1)
+    for _ in range(3):
+        try:
+            date = month.replace(day=day).date()
+        except ValueError:
+            date = None
+        if date and date >= now.date():
+            return date
+        month = (month + timedelta(days=32)).replace(day=1)
+    return None
+
+def _part_of_day(text):
+    """(first_hour, end_hour) for "morning", "afternoon" or "evening", else None."""
+    m = _PART_OF_DAY_RE.search(text)
+    return _PART_OF_DAY_HOURS[m.group(1)] if m else None
+
+def _explicit_date(text, now, bare_day=True):
+    m = _MONTH_DAY_RE.search(text)
+    if m:
+        month, day = _MONTHS[m.group(1)], int(m.group(2))
+    else:
+        m = _NUMERIC_DATE_RE.search(text)
+        if not m:
+            day = _day_of_month(text) if bare_day else None
+            return _next_day_of_month(day, now) if day else None
+        month, day = int(m.group(1)), int(m.group(2))
+    try:
+        date = now.replace(month=month, day=day).date()
+    except ValueError:
+        return None
+    if date < now.date():
+        try:
+            date = date.replace(year=date.year + 1)
+        except ValueError:
+            return None
+    return date
+
+def _relative_date(text, now):
+    m = _RELATIVE_RE.search(text)
+    if not m:
+        return None
+    return (now + timedelta(days=1 if m.group(1) == "tomorrow" else 0)).date()
+
+def _match_offered(text, offered, now):
+    slots = sorted(datetime.fromisoformat(s) for s in offered)
+    candidates, constrained = slots, False
+
+    days = _weekdays(text)
+    if days:
+        candidates = [s for s in candidates if s.weekday() in days]
+        constrained = True
+    date = _explicit_date(text, now, bare_day=False) or _relative_date(text, now)
+    day = _day_of_month(text)
+    if date:
+        candidates = [s for s in candidates if s.date() == date]
+        constrained = True
+    elif day and (day > len(slots) or any(s.day == day for s in slots)):
+        # "the 2nd" with nothing offered on the 2nd means the second option
+        candidates = [s for s in candidates if s.day == day]
+        constrained = True
+    part = _part_of_day(text)
+    if part:
+        candidates = [s for s in candidates if part[0] <= s.hour < part[1]]
+        constrained = True
+    tod = _time_of_day(text)
+    if tod:
+        hour, minute, exact = tod
+        candidates = [
+            s for s in candidates
+            if s.minute == minute and (s.hour == hour if exact else s.hour % 12 == hour % 12)
+        ]
+        constrained = True
+
+    if constrained:
+        # "Tuesday works" with several Tuesday slots on offer is ambiguous; let the
+        # general parsers have it rather than guess
+        return candidates[0] if len(candidates) == 1 else None
+
+    m = _OPTION_RE.search(text)
+    index = int(m.group(1)) - 1 if m else None
+    if index is None:
+        m = _ORDINAL_RE.search(text)
+        index = _ORDINALS[m.group(1)] if m else None
+    if index is not None and 0 <= index < len(slots):
+        return slots[index]
+    return None
+
+def _match_pattern(text, now):
+    tod = _time_of_day(text)
+    if not tod:
+        return None
+    hour, minute, exact = tod
+    if not exact and hour < 8:
+        # "at 3" in a scheduling reply means the afternoon
+        hour += 12
+
+    date = _relative_date(text, now) or _explicit_date(text, now)
+    if date is None:
+        days = _weekdays(text)
+        if len(days) == 1:
+            ahead = (days.pop() - now.weekday()) % 7 or 7
+            date = (now + timedelta(days=ahead)).date()
+    candidate = datetime.combine(date or now.date(), datetime.min.time()).replace(hour=hour, minute=minute)
+    if date is None and candidate <= now:
+        candidate += timedelta(days=1)
+    return candidate
+
+def _match_dateparser(text, now):
+    import dateparser
+    return dateparser.parse(text, settings={"PREFER_DATES_FROM": "future", "RELATIVE_BASE": now})
+
+def _match_dateutil(text, now):
+    from dateutil.parser import parse as date_parse
+    try:
+        return date_parse(text, default=now, fuzzy=True)
+    except (ValueError, OverflowError):
+        return None
+
+def match_reply(text, offered=None, now=None):
+    """Turn a reply like "Tuesday 2pm works" into a datetime.
+
+    Tries the slots we actually offered first, then a few compiled patterns, and
+    only then the general-purpose parsers. Returns (datetime or None, path).
+    """
+    now = now or datetime.now()
+    lower = (text or "").lower()
+    stages = [
+        ("offered", lambda: _match_offered(lower, offered, now)),
+        ("pattern", lambda: _match_pattern(lower, now)),
+        ("dateparser", lambda: _match_dateparser(text, now)),
+        ("dateutil", lambda: _match_dateutil(text, now)),
+    ]
+    for path, stage in stages:
+        if path == "offered" and not offered:
+            continue
+        start = time.perf_counter()
+        result = stage()
+        _record(path, result is not None, time.perf_counter() - start)
+        if result is not None:
+            return result, path
+    return None, None
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+from slot_parser import clean_reply, match_reply
+
+NOW = datetime(2026, 10, 19, 10, 0)    # a Monday
+OFFERED = [
+    "2026-10-19T14:00:00",
+    "2026-10-20T09:00:00",
+    "2026-10-20T14:00:00",
+    "2026-10-21T11:00:00",
+]
+
+def offered(text):
+    return match_reply(text, OFFERED, now=NOW)
+
+def test_weekday_and_time():
+    assert offered("Tuesday 2pm works") == (datetime(2026, 10, 20, 14), "offered")
+
+def test_day_of_month_with_meridiem():
+    assert offered("Sure, 2pm on the 20th") == (datetime(2026, 10, 20, 14), "offered")
+
+def test_day_of_month_with_bare_hour():
+    assert offered("I am free on the 20th at 2") == (datetime(2026, 10, 20, 14), "offered")
+
+def test_part_of_day():
+    assert offered("Thanks! Tuesday afternoon") == (datetime(2026, 10, 20, 14), "offered")
+    assert offered("Tuesday morning is best") == (datetime(2026, 10, 20, 9), "offered")
+
+def test_numeric_date():
+    assert offered("10/21 is good") == (datetime(2026, 10, 21, 11), "offered")
+
+def test_option_and_ordinal():
+    assert offered("Option 3 please") == (datetime(2026, 10, 20, 14), "offered")
+    assert offered("the 2nd one works") == (datetime(2026, 10, 20, 9), "offered")
+
+def test_ambiguous_reply_falls_through():
+    result, path = offered("Tuesday works")
+    assert path != "offered"
+
+def test_unoffered_day_is_not_matched_to_another_day():
+    result, path = offered("2pm on the 25th")
+    assert path != "offered"
+    assert result == datetime(2026, 10, 25, 14)
+
+def test_pattern_without_offered_slots():
+    assert match_reply("the 20th at 3", now=NOW) == (datetime(2026, 10, 20, 15), "pattern")
+    assert match_reply("tomorrow at 4pm", now=NOW) == (datetime(2026, 10, 20, 16), "pattern")
+
+def test_clean_reply_drops_quoted_original():
+    snippet = "Tuesday 2pm works On Mon, Oct 19, 2026 at 9:00 AM Alice wrote: Here are my slots"
+    assert clean_reply(snippet) == "Tuesday 2pm works"
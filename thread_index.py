@@ -0,0 +1,125 @@
+import re
+from datetime import datetime, timezone
+from models import db, EmailThread
+
+# Threads get a larger budget than single messages; they summarise many of them
+MAX_THREAD_CHARS = 4000
+
+_REPLY_HEADERS = [
+    # Gmail / Apple Mail, sometimes wrapped onto a second line
+    re.compile(r"^On\b[^\n]*(?:\n[^\n]*)?\bwrote:\s*$", re.M),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}\s*$", re.M | re.I),
+    # Outlook separator line and header block
+    re.compile(r"^_{20,}\s*$", re.M),
+    re.compile(r"^From:\s.*\n(?:.*\n){0,3}?(?:Sent|Date):\s", re.M),
+]
+
+def strip_quoted(text):
+    """Return only the new content of a reply: drop quoted history and the signature."""
+    if not text:
+        return ''
+    text = text.replace('\r\n', '\n')
+    cut = len(text)
+    for pattern in _REPLY_HEADERS:
+        for m in pattern.finditer(text):
+            # A forwarded message's header block is new content, not quoted history
+            if 'Forwarded message' in text[max(0, m.start() - 100):m.start()]:
+                continue
+            cut = min(cut, m.start())
+            break
+    lines = [l for l in text[:cut].split('\n') if not l.lstrip().startswith('>')]
+    new = '\n'.join(lines)
+    sig = new.find('\n-- \n')
+    if sig != -1:
+        new = new[:sig]
+    return re.sub(r'\n{3,}', '\n\n', new).strip()
+
+def _base_subject(subject):
+    return re.sub(r'^((re|fwd?|aw)\s*:\s*)+', '', subject or '', flags=re.I).strip()
+
+def thread_text(thread):
+    header = ' '.join(filter(None, [
+        thread.subject,
+        'Participants: ' + ', '.join(thread.participants or []),
+    ]))
+    # When the thread is too long, the most recent messages win
+    lines, budget = [], MAX_THREAD_CHARS - len(header) - 1
+    for seg in reversed(thread.segments or []):
+        if not seg['text']:
+            continue
+        line = f"{seg['from']}: {seg['text']}"
+        if len(line) + 1 > budget:
+            if not lines:
+                lines.append(line[:budget])
+            break
+        lines.append(line)
+        budget -= len(line) + 1
+    return '\n'.join([header] + lines[::-1])
+
+def naive_utc(dt):
+    """`dt` converted to UTC without tzinfo; naive datetimes are taken to be UTC already."""
+    if dt is not None and dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt
+
+def _segment_date(seg):
+    # Older segments may carry an offset; compare them all as naive UTC
+    return naive_utc(datetime.fromisoformat(seg['date'])) if seg.get('date') else datetime.min
+
+def thread_document(thread):
+    return thread_text(thread), {
+        'doc_type': 'thread',
+        'doc_id': thread.id,
+        'thread_id': thread.id,
+        'subject': thread.subject,
+        'date': thread.last_date.isoformat() if thread.last_date else None,
+    }
+
+def apply_to_threads(email_recs):
+    """Fold new messages into their thread rows.
+
+    Returns (thread_id, text, metadata) for every thread that changed, so the
+    caller can re-embed just those. Nothing is committed: the caller commits once
+    the new thread embeddings are stored, or rolls back so the messages count as
+    new again on the next run.
+    """
+    by_thread = {}
+    for rec in email_recs:
+        if rec.thread_id:
+            by_thread.setdefault(rec.thread_id, []).append(rec)
+
+    changed = []
+    for thread_id, recs in by_thread.items():
+        thread = db.session.get(EmailThread, thread_id) or EmailThread(
+            id=thread_id, participants=[], segments=[]
+        )
+        known = {seg['id'] for seg in thread.segments or []}
+        fresh = [rec for rec in recs if rec.id not in known]
+        if not fresh:
+            continue
+
+        segments = list(thread.segments or [])
+        participants = list(thread.participants or [])
+        for rec in fresh:
+            segments.append({
+                'id': rec.id,
+                'date': naive_utc(rec.date).isoformat() if rec.date else '',
+                'from': rec.sender_name or rec.sender,
+                'text': strip_quoted(rec.body) or (rec.snippet or ''),
+            })
+            if rec.sender and rec.sender not in participants:
+                participants.append(rec.sender)
+        segments.sort(key=_segment_date)
+
+        # Reassign rather than mutate so the JSON columns are flagged dirty
+        thread.segments = segments
+        thread.participants = participants
+        thread.subject = thread.subject or _base_subject(fresh[0].subject)
+        dates = [naive_utc(rec.date) for rec in fresh if rec.date]
+        if dates:
+            latest = max(dates)
+            thread.last_date = max(thread.last_date, latest) if thread.last_date else latest
+        db.session.merge(thread)
+
+        changed.append((thread_id, *thread_document(thread)))
+    return changed
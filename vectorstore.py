@@ -1,25 +1,361 @@
 import os
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import PGVector
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
 from dotenv import load_dotenv
-load_dotenv()
+from sqlalchemy import text
+from database import get_engine, lift_statement_timeout
+from documents import MAX_EMBED_CHARS
+from models import EMBEDDING_DIM, LEGACY_COLLECTION
+from partitions import add_months, horizon, month_start
 
-# Initialize embeddings and vectorstore
-env_url = os.getenv("DATABASE_URL")
-embeddings = OpenAIEmbeddings()
-vectordb = PGVector(
-    connection_string=env_url,
-    embedding_function=embeddings,
-)
+# float32 compares the full vectors exactly. halfvec and binary run the ANN search
+# on a compact expression index over `embeddings`, then rerank the candidates
+# against the full-precision vectors
+SEARCH_MODES = ("float32", "halfvec", "binary")
+SEARCH_MODE = os.getenv("VECTOR_SEARCH_MODE", "float32")
+# Candidates fetched per result before reranking; binary codes need a wider net
+RERANK_FACTOR = {"halfvec": 4, "binary": 10}
+if os.getenv("VECTOR_RERANK_FACTOR"):
+    RERANK_FACTOR = dict.fromkeys(RERANK_FACTOR, int(os.getenv("VECTOR_RERANK_FACTOR")))
+RERANK_FACTOR["float32"] = 1
+# Several chunks and messages of one thread crowd the nearest neighbours; fetch
+# this many more candidates so k distinct threads survive the per-thread dedupe
+THREAD_FANOUT = int(os.getenv("VECTOR_THREAD_FANOUT", 3))
+# Search starts with the newest monthly partitions of `embeddings` and widens, one
+# tier at a time, only while too few hits reach MIN_SIMILARITY. Tiers are given
+# in months back from the current one; after the last, everything older is searched.
+RECENCY_TIERS = tuple(int(m) for m in os.getenv("VECTOR_RECENCY_TIERS", "2,12").split(",") if m)
+MIN_SIMILARITY = float(os.getenv("VECTOR_MIN_SIMILARITY", 0.8))
+# Ranking adds RECENCY_WEIGHT for a document from today, halving every half-life
+RECENCY_WEIGHT = float(os.getenv("VECTOR_RECENCY_WEIGHT", 0.05))
+RECENCY_HALF_LIFE_DAYS = float(os.getenv("VECTOR_RECENCY_HALF_LIFE_DAYS", 30))
+# How long a process trusts its view of the index versions; a cutover reaches
+# every worker within this many seconds, and both collections serve until then
+VERSION_TTL = float(os.getenv("INDEX_VERSION_TTL", 10))
 
-# Retrieve top-k docs
-def get_top_k_docs(query: str, k: int = 5):
-    docs = vectordb.similarity_search(query, k=k)
-    # Assuming each doc has page_content and metadata
-    results = []
-    for d in docs:
+# The HNSW index each compact mode searches; only the configured mode's is kept,
+# since every insert updates each graph and each one wants to stay in memory
+ANN_INDEXES = {
+    "halfvec": ("ix_embeddings_vector_halfvec", f"(vector::halfvec({EMBEDDING_DIM})) halfvec_cosine_ops"),
+    "binary": ("ix_embeddings_vector_binary", f"(binary_quantize(vector)::bit({EMBEDDING_DIM})) bit_hamming_ops"),
+}
+
+_ANN_ORDER = {
+    "float32": f"e.vector <=> CAST(:query AS vector({EMBEDDING_DIM}))",
+    "halfvec": f"e.vector::halfvec({EMBEDDING_DIM}) <=> CAST(:query AS halfvec({EMBEDDING_DIM}))",
+    "binary": (
+        f"binary_quantize(e.vector)::bit({EMBEDDING_DIM}) "
+        f"<~> binary_quantize(CAST(:query AS vector({EMBEDDING_DIM})))"
+    ),
+}
+
+IndexConfig = namedtuple("IndexConfig", "collection model dimensions chunk_chars")
+# What served search before index_versions existed
+LEGACY_CONFIG = IndexConfig(LEGACY_COLLECTION, "text-embedding-ada-002", None, MAX_EMBED_CHARS)
+
+_versions = (0.0, None, 1)
+
+def _load_versions():
+    global _versions
+    loaded_at, versions, _ = _versions
+    if versions is None or time.monotonic() - loaded_at > VERSION_TTL:
+        _refresh_versions()
+    return _versions
+
+def _refresh_versions():
+    global _versions
+    with get_engine().connect() as conn:
+        rows = conn.execute(text(
+            "SELECT collection, model, dimensions, chunk_chars, status FROM index_versions ORDER BY id"
+        )).all()
+    active = [IndexConfig(*row[:4]) for row in rows if row.status == "active"]
+    building = [IndexConfig(*row[:4]) for row in rows if row.status == "building"]
+    # Every version keeps its vectors in `embeddings` until it is dropped
+    _versions = (time.monotonic(), (active[-1] if active else LEGACY_CONFIG, building), max(1, len(rows)))
+
+def live_versions(refresh=False):
+    """(active, [building...]) index configs, re-read from index_versions every VERSION_TTL seconds."""
+    if refresh:
+        _refresh_versions()
+    return _load_versions()[1]
+
+def _shared_collections():
+    """How many collections' vectors share the `embeddings` ANN indexes."""
+    return _load_versions()[2]
+
+_iterative_scan = None
+
+def _supports_iterative_scan(conn):
+    # hnsw.iterative_scan arrived in pgvector 0.8; older servers reject the setting
+    global _iterative_scan
+    if _iterative_scan is None:
+        version = conn.execute(text(
+            "SELECT extversion FROM pg_extension WHERE extname = 'vector'"
+        )).scalar() or "0"
+        _iterative_scan = tuple(int(p) for p in version.split(".")[:2] if p.isdigit()) >= (0, 8)
+    return _iterative_scan
+
+def active_version():
+    return live_versions()[0]
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_vectordb(config=None):
+    """Return the PGVector store of `config` (default: the active version), creating it on first use.
+
+    langchain is slow to import and PGVector connects to the database as soon as
+    it is constructed, so neither happens at import time.
+    """
+    config = config or active_version()
+    store = _stores.get(config.collection)
+    if store is None:
+        with _stores_lock:
+            store = _stores.get(config.collection)
+            if store is None:
+                from langchain.embeddings.openai import OpenAIEmbeddings
+                from langchain.vectorstores import PGVector
+                load_dotenv()
+                first = not _stores
+                store = PGVector(
+                    connection_string=os.getenv("DATABASE_URL"),
+                    collection_name=config.collection,
+                    embedding_function=OpenAIEmbeddings(
+                        model=config.model,
+                        model_kwargs={"dimensions": config.dimensions} if config.dimensions else {},
+                    ),
+                    connection=get_engine(),
+                )
+                if first:
+                    # range_search joins back to the documents by custom_id
+                    with get_engine().begin() as conn:
+                        conn.execute(text(
+                            "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_custom_id "
+                            "ON langchain_pg_embedding (custom_id)"
+                        ))
+                _stores[config.collection] = store
+    return store
+
+def sync_ann_index(mode=None):
+    """Build the ANN index `mode` (default VECTOR_SEARCH_MODE) searches and drop the others.
+
+    float32 compares full vectors and needs none. Returns (created, dropped) index names.
+    """
+    mode = mode or SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown VECTOR_SEARCH_MODE {mode!r}; expected one of {SEARCH_MODES}")
+    created, dropped = [], []
+    with get_engine().begin() as conn:
+        lift_statement_timeout(conn)
+        # Workers starting together would otherwise race to build the same index
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('embeddings ann index'))"))
+        existing = set(conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'embeddings'"
+        )).scalars())
+        for index_mode, (name, expression) in ANN_INDEXES.items():
+            if index_mode == mode and name not in existing:
+                conn.execute(text(f"CREATE INDEX {name} ON embeddings USING hnsw ({expression})"))
+                created.append(name)
+            elif index_mode != mode and name in existing:
+                conn.execute(text(f"DROP INDEX {name}"))
+                dropped.append(name)
+    return created, dropped
+
+def delete_documents(ids, config=None):
+    get_vectordb(config).delete(ids=ids)
+
+def upsert_embeddings(texts, vectors, metadatas, ids, config=None):
+    # add_embeddings always inserts, so drop any previous rows for these ids first
+    delete_documents(ids, config)
+    get_vectordb(config).add_embeddings(
+        texts=texts, embeddings=vectors, metadatas=metadatas, ids=ids
+    )
+
+def _to_literal(vector):
+    return "[" + ",".join(map(str, vector)) + "]"
+
+def range_search(query_vector, k, mode, config=None, since=None, until=None):
+    """Top-k rows (document, cmetadata, doc_date, similarity) among documents dated in [since, until).
+
+    The date bounds prune `embeddings` to the partitions they cover, and the
+    ANN search runs on those partitions' indexes alone. halfvec and binary
+    candidates are reranked by full-precision distance. Only the best row of
+    each thread is returned.
+    """
+    config = config or active_version()
+    candidates = k * RERANK_FACTOR[mode] * THREAD_FANOUT
+    bounds = "".join([
+        " AND e.doc_date >= :since" if since else "",
+        " AND e.doc_date < :until" if until else "",
+    ])
+    sql = text(f"""
+        WITH candidates AS (
+            SELECT e.doc_type, e.doc_id, e.vector, e.doc_date
+            FROM embeddings e
+            WHERE e.collection = :collection{bounds}
+            ORDER BY {_ANN_ORDER[mode]}
+            LIMIT :candidates
+        )
+        SELECT document, cmetadata, doc_date, similarity FROM (
+            SELECT DISTINCT ON (COALESCE(d.cmetadata->>'thread_id', d.cmetadata->>'doc_id'))
+                   d.document, d.cmetadata, c.doc_date,
+                   1 - (c.vector <=> CAST(:query AS vector({EMBEDDING_DIM}))) AS similarity
+            FROM candidates c
+            JOIN langchain_pg_embedding d ON d.custom_id = c.doc_type || ':' || c.doc_id
+            JOIN langchain_pg_collection col ON col.uuid = d.collection_id AND col.name = :collection
+            ORDER BY COALESCE(d.cmetadata->>'thread_id', d.cmetadata->>'doc_id'),
+                     c.vector <=> CAST(:query AS vector({EMBEDDING_DIM}))
+        ) best
+        ORDER BY similarity DESC
+        LIMIT :k
+    """)
+    with get_engine().begin() as conn:
+        # HNSW returns at most ef_search rows and the collection filter applies after
+        # the index scan, so while several versions share the index (during a rebuild,
+        # or until retired ones are dropped) the scan has to look that much further
+        shared = _shared_collections()
+        conn.execute(text(f"SET LOCAL hnsw.ef_search = {min(1000, max(40, candidates * shared))}"))
+        if shared > 1 and _supports_iterative_scan(conn):
+            # Keep scanning until enough rows pass the filter; the outer query reorders them
+            conn.execute(text("SET LOCAL hnsw.iterative_scan = relaxed_order"))
+        return conn.execute(sql, {
+            "query": _to_literal(query_vector),
+            "candidates": candidates,
+            "collection": config.collection,
+            "since": since,
+            "until": until,
+            "k": k,
+        }).all()
+
+def hot_cutoff(now=None):
+    """Start of the newest search tier, always on a partition boundary."""
+    months = RECENCY_TIERS[0] if RECENCY_TIERS else 1
+    return add_months(month_start(now or datetime.utcnow()), 1 - months)
+
+_horizon = (0.0, None)
+
+def _partition_horizon():
+    """partitions.horizon() of `embeddings`, re-read every VERSION_TTL seconds."""
+    global _horizon
+    loaded_at, value = _horizon
+    if not loaded_at or time.monotonic() - loaded_at > VERSION_TTL:
+        value = horizon('embeddings')
+        _horizon = (time.monotonic(), value)
+    return value
+
+def _tiers(now, end=None):
+    """[since, until) ranges from newest to oldest.
+
+    The newest tier stops at `end`, where the monthly partitions stop, so the
+    DEFAULT partition can be pruned from it; what's dated later (far-off events)
+    is searched as a tier of its own right after it.
+    """
+    cutoffs = [add_months(month_start(now), 1 - months) for months in RECENCY_TIERS]
+    bounds = [None] + cutoffs + [None]
+    tiers = [(bounds[i + 1], bounds[i]) for i in range(len(bounds) - 1)]
+    if end is not None and (tiers[0][0] is None or end > tiers[0][0]):
+        tiers[:1] = [(tiers[0][0], end), (end, None)]
+    return tiers
+
+_unkeyed = {}
+
+def _has_unkeyed(collection):
+    # Every write is keyed now, so once a collection has none it never will again
+    if _unkeyed.get(collection) is not False:
+        with get_engine().connect() as conn:
+            _unkeyed[collection] = conn.execute(text(
+                "SELECT EXISTS (SELECT 1 FROM langchain_pg_embedding d "
+                "JOIN langchain_pg_collection c ON c.uuid = d.collection_id "
+                "WHERE c.name = :name AND d.embedding IS NOT NULL "
+                "AND (d.custom_id IS NULL OR d.custom_id NOT LIKE '%:%'))"
+            ), {"name": collection}).scalar()
+    return _unkeyed[collection]
+
+def _unkeyed_search(query_vector, k, collection):
+    """Top-k legacy vector-store rows that never got a "<doc_type>:<doc_id>" id.
+
+    They have no row in `embeddings` to be found through, so they're compared
+    directly; there are only ever as many as the re-keying migration left behind.
+    """
+    with get_engine().connect() as conn:
+        return conn.execute(text(f"""
+            SELECT d.document, d.cmetadata, TIMESTAMP '1970-01-01' AS doc_date,
+                   1 - (d.embedding <=> CAST(:query AS vector({EMBEDDING_DIM}))) AS similarity
+            FROM langchain_pg_embedding d
+            JOIN langchain_pg_collection c ON c.uuid = d.collection_id
+            WHERE c.name = :name AND d.embedding IS NOT NULL
+              AND (d.custom_id IS NULL OR d.custom_id NOT LIKE '%:%')
+            ORDER BY d.embedding <=> CAST(:query AS vector({EMBEDDING_DIM}))
+            LIMIT :k
+        """), {"query": _to_literal(query_vector), "name": collection, "k": k}).all()
+
+def _score(row, now):
+    age_days = max((now - row.doc_date).total_seconds() / 86400, 0)
+    return row.similarity + RECENCY_WEIGHT * 0.5 ** (age_days / RECENCY_HALF_LIFE_DAYS)
+
+def recency_search(query_vector, k, mode, config=None, enough=None, now=None):
+    """Top-k hits, one per thread, searching the newest documents first.
+
+    Older tiers are only searched while fewer than `enough` (default k) distinct
+    threads have a hit with similarity >= MIN_SIMILARITY. Most questions are about
+    recent mail, so most queries only touch the newest partitions, however much
+    history is stored. Hits are ranked by similarity plus a recency bonus and
+    come back as search_by_vector returns them.
+    """
+    config = config or active_version()
+    now = now or datetime.utcnow()
+    enough = enough or k
+    rows, good = [], set()
+    for since, until in _tiers(now, _partition_horizon()):
+        for row in range_search(query_vector, k, mode, config, since, until):
+            rows.append(row)
+            if row.similarity >= MIN_SIMILARITY:
+                meta = row.cmetadata or {}
+                good.add(meta.get("thread_id") or meta.get("doc_id"))
+        if len(good) >= enough:
+            break
+    if _has_unkeyed(config.collection):
+        rows += _unkeyed_search(query_vector, k, config.collection)
+    rows.sort(key=lambda row: _score(row, now), reverse=True)
+    # Tiers are deduplicated per thread on their own; a thread can still span two
+    return _best_per_thread([(row.document, row.cmetadata) for row in rows], k)
+
+def _best_per_thread(hits, k):
+    # Keep only the best hit per thread so each slot adds new information
+    results, seen = [], set()
+    for content, meta in hits:
+        meta = meta or {}
+        key = meta.get("thread_id") or meta.get("doc_id")
+        if key is not None and key in seen:
+            continue
+        seen.add(key)
         results.append({
-            "content": d.page_content,
-            **(d.metadata or {})
+            "content": content,
+            **meta
         })
-    return results
\ No newline at end of file
+        if len(results) == k:
+            break
+    return results
+
+def search_by_vector(query_vector, k=5, mode=None, config=None):
+    """get_top_k_docs for a query that has already been embedded with `config`'s model."""
+    mode = mode or SEARCH_MODE
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown VECTOR_SEARCH_MODE {mode!r}; expected one of {SEARCH_MODES}")
+    config = config or active_version()
+    if len(query_vector) == EMBEDDING_DIM:
+        return recency_search(query_vector, k, mode, config)
+    # `embeddings` only holds EMBEDDING_DIM vectors; other sizes live only in PGVector.
+    # Over-fetch, since several hits may come from the same thread
+    store = get_vectordb(config)
+    hits = [(d.page_content, d.metadata) for d in store.similarity_search_by_vector(query_vector, k=k * 3)]
+    return _best_per_thread(hits, k)
+
+# Retrieve top-k docs
+def get_top_k_docs(query: str, k: int = 5, mode: str = None):
+    # Read one version for the whole query, even if a cutover lands meanwhile
+    config = active_version()
+    query_vector = get_vectordb(config).embedding_function.embed_query(query)
+    return search_by_vector(query_vector, k, mode, config)